@@ -3,15 +3,32 @@
 # hmm.py: Implementation of a hidden markov model for the Umbrella domain.
 # Author: Harald Husum
 # Date: 02.03.2016
+import math
+import time
+from collections import deque
+from typing import Deque
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
 
 import numpy as np
 
+# The Umbrella domain, with evidence symbol 0 for no umbrella and 1 for umbrella
+UMBRELLA_TRANSITION = np.array([[0.7, 0.3], [0.3, 0.7]])
+UMBRELLA_SENSOR = np.array([[0.1, 0.9], [0.8, 0.2]])
+
 
 def normalize(vector: np.ndarray) -> np.ndarray:
     return vector / vector.sum()
 
 
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / matrix.sum(axis=-1, keepdims=True)
+
+
 def forward(
     sensor_model: np.ndarray, transition_model: np.ndarray, message: np.ndarray
 ) -> np.ndarray:
@@ -26,52 +43,521 @@ def backward(
     return transition_model @ sensor_model @ message
 
 
-def forward_backward(evidence: np.ndarray, prior: np.ndarray) -> List[np.ndarray]:
-    """The forward–backward algorithm for smoothing: computing posterior prob-
-    abilities of a sequence of states given a sequence of observations.
+class HMM:
+    """A hidden Markov model with S states and K observation symbols.
+
+    The products of the diagonal sensor matrix of every observation symbol with
+    the transition model are computed once, on construction, so stepping a
+    message becomes a table lookup followed by a single matrix-vector product.
+    """
+
+    def __init__(self, transition_model: np.ndarray, sensor_model: np.ndarray):
+        """
+        :param transition_model: S x S matrix, P(Xₜ = j | Xₜ₋₁ = i) at [i, j]
+        :param sensor_model: S x K matrix, P(Eₜ = k | Xₜ = i) at [i, k]
+        """
+        transition_model = np.asarray(transition_model, dtype=float)
+        sensor_model = np.asarray(sensor_model, dtype=float)
+        states = transition_model.shape[0]
+        if transition_model.shape != (states, states):
+            raise ValueError("transition model must be a square matrix")
+        if sensor_model.ndim != 2 or sensor_model.shape[0] != states:
+            raise ValueError("sensor model must have one row per state")
+
+        self.transition_model: np.ndarray = transition_model
+        self.sensor_model: np.ndarray = sensor_model
+        self.states: int = states
+        self.symbols: int = sensor_model.shape[1]
+
+        # The rows of sensor_columns are the diagonals of the sensor matrices
+        self.sensor_columns: np.ndarray = np.ascontiguousarray(sensor_model.T)
+        # forward_tables[k] = O_k @ T.T and backward_tables[k] = T @ O_k
+        self.forward_tables: np.ndarray = (
+            self.sensor_columns[:, :, np.newaxis] * transition_model.T
+        )
+        self.backward_tables: np.ndarray = (
+            transition_model * self.sensor_columns[:, np.newaxis, :]
+        )
+
+    normalize = staticmethod(normalize)
+
+    def forward(self, evidence: int, message: np.ndarray) -> np.ndarray:
+        # As defined in Russel Norvig Equation 15.12
+        return normalize(self.forward_tables[int(evidence)] @ message)
+
+    def backward(self, evidence: int, message: np.ndarray) -> np.ndarray:
+        # As defined in Russel Norvig Equation 15.13
+        return self.backward_tables[int(evidence)] @ message
+
+    def forward_backward(
+        self, evidence: np.ndarray, prior: np.ndarray
+    ) -> List[np.ndarray]:
+        """The forward–backward algorithm for smoothing: computing posterior
+        probabilities of a sequence of states given a sequence of observations.
+
+        As defined in Russel Norvig Figure 15.4, with the backward message
+        normalized at every step to keep long sequences from underflowing.
+
+        :param evidence: A vector of evidence symbols for steps 1, ..., t
+        :param prior: The prior distribution on the initial state, P(X₀)
+        :return: smoothed estimates
+        """
+        forward_messages = [prior]
+        for e in evidence:
+            forward_messages.append(self.forward(e, forward_messages[-1]))
+
+        smoothed_estimates = [prior] * len(evidence)
+        backward_message = np.ones_like(prior, dtype=float)
+        for i in range(len(evidence) - 1, -1, -1):
+            smoothed_estimates[i] = normalize(
+                forward_messages[i + 1] * backward_message
+            )
+            backward_message = normalize(self.backward(evidence[i], backward_message))
+
+        return smoothed_estimates
+
+    def forward_backward_checkpointed(
+        self,
+        evidence: np.ndarray,
+        prior: np.ndarray,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Forward–backward smoothing in O(√t) memory for very long sequences.
+
+        Only every ⌈√t⌉-th forward message is kept during the forward sweep.
+        The backward sweep recomputes the forward messages of one segment at a
+        time from its checkpoint, roughly doubling the forward work.
+
+        :param evidence: A vector of evidence symbols for steps 1, ..., t
+        :param prior: The prior distribution on the initial state, P(X₀)
+        :param out: Optional preallocated, possibly memory-mapped, (t, S)
+            array to write the smoothed estimates into
+        :return: (t, S) smoothed estimates
+        """
+        steps = len(evidence)
+        if out is None:
+            out = np.empty((steps, self.states))
+        elif out.shape != (steps, self.states):
+            raise ValueError("output array must have shape (len(evidence), S)")
+        if steps == 0:
+            return out
+
+        segment = math.isqrt(steps - 1) + 1
+        checkpoints = [np.ravel(prior).astype(float)]
+        message = checkpoints[0]
+        for t in range(steps):
+            message = self.forward(evidence[t], message)
+            if (t + 1) % segment == 0:
+                checkpoints.append(message)
+
+        backward_message = np.ones(self.states)
+        for start in range((steps - 1) // segment * segment, -1, -segment):
+            stop = min(start + segment, steps)
+            forward_messages = [checkpoints[start // segment]]
+            for t in range(start, stop):
+                forward_messages.append(self.forward(evidence[t], forward_messages[-1]))
+
+            for t in range(stop - 1, start - 1, -1):
+                out[t] = normalize(forward_messages[t - start + 1] * backward_message)
+                backward_message = normalize(
+                    self.backward(evidence[t], backward_message)
+                )
+
+        return out
+
+    def forward_backward_batch(
+        self, evidence: np.ndarray, lengths: np.ndarray, prior: np.ndarray
+    ) -> np.ndarray:
+        """Vectorized forward–backward smoothing of a batch of evidence sequences.
+
+        Every sequence is advanced one time step at a time in lockstep, so the
+        number of Python-level iterations grows with the longest sequence
+        rather than with the total amount of evidence. Both the forward and the
+        backward messages are normalized at every step, which keeps long
+        sequences from underflowing without changing the smoothed estimates.
+
+        :param evidence: Padded (batch, T) array of observation symbols.
+            Boolean evidence is treated as the symbols 0 (False) and 1 (True)
+        :param lengths: The number of valid steps of each sequence, (batch,)
+        :param prior: The prior distribution on the initial state, P(X₀),
+            either shared, shape (S,) or (S, 1), or per sequence, (batch, S)
+        :return: (batch, T, S) smoothed estimates, zero beyond sequence ends
+        """
+        evidence, active = _padded_evidence(evidence, lengths)
+        smoothed = np.empty(evidence.shape + (self.states,))
+        # The forward messages are written straight into the output array and
+        # turned into smoothed estimates in place during the backward sweep
+        self._forward_sweep(evidence, active, prior, smoothed)
+        self._backward_sweep(evidence, active, smoothed)
+        smoothed[~active] = 0.0
+        return smoothed
+
+    def viterbi_batch(
+        self, evidence: np.ndarray, lengths: np.ndarray, prior: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The Viterbi algorithm for a batch of evidence sequences, computed in
+        log space: the most likely state sequence given each evidence sequence.
+
+        :param evidence: Padded (batch, T) array of observation symbols
+        :param lengths: The number of valid steps of each sequence, (batch,)
+        :param prior: The prior distribution on the initial state, P(X₀)
+        :return: (batch, T) most likely states, -1 beyond sequence ends, and
+            the (batch,) log probabilities of those paths jointly with the
+            evidence
+        """
+        evidence, active = _padded_evidence(evidence, lengths)
+        batch_size, steps = evidence.shape
+        prior = _batch_prior(prior, batch_size, self.states)
+        with np.errstate(divide="ignore"):
+            log_transition = np.log(self.transition_model)
+            log_sensor = np.log(self.sensor_columns)
+            message = np.log(prior)
+            if steps:
+                # X₀ is not part of the path, so it is summed out: the first
+                # message is log P(X₁, e₁), and the maximization starts at X₂
+                first = np.log(prior @ self.transition_model)
+                first += log_sensor[evidence[:, 0]]
+                message = np.where(active[:, 0, np.newaxis], first, message)
+
+        rows = np.arange(batch_size)
+        pointers = np.empty((batch_size, steps, self.states), dtype=np.intp)
+        for t in range(1, steps):
+            # As defined in Russel Norvig Equation 15.11, one row per sequence
+            scores = message[:, :, np.newaxis] + log_transition
+            pointers[:, t] = scores.argmax(axis=1)
+            stepped = scores.max(axis=1) + log_sensor[evidence[:, t]]
+            message = np.where(active[:, t, np.newaxis], stepped, message)
+
+        paths = np.full((batch_size, steps), -1, dtype=np.intp)
+        state = message.argmax(axis=1)
+        for t in range(steps - 1, -1, -1):
+            paths[active[:, t], t] = state[active[:, t]]
+            state = np.where(active[:, t], pointers[rows, t, state], state)
+
+        return paths, message.max(axis=1)
+
+    def baum_welch(
+        self,
+        evidence: np.ndarray,
+        lengths: np.ndarray,
+        prior: np.ndarray,
+        iterations: int = 100,
+        tolerance: float = 1e-6,
+    ) -> Tuple["HMM", np.ndarray, List["EMIteration"]]:
+        """The Baum–Welch algorithm: expectation–maximization of the transition
+        and sensor models, and the prior, from unlabeled evidence sequences.
+
+        Each iteration is one batched forward–backward pass. The expected
+        transition and sensor counts are accumulated with array reductions
+        over the whole batch.
+
+        :param evidence: Padded (batch, T) array of observation symbols
+        :param lengths: The number of valid steps of each sequence, (batch,)
+        :param prior: The initial guess for the prior distribution, P(X₀)
+        :param iterations: The maximum number of EM iterations
+        :param tolerance: Stop once the log likelihood improves by less
+        :return: The fitted model, the fitted prior and per-iteration stats
+        """
+        evidence, active = _padded_evidence(evidence, lengths)
+        batch_size, steps = evidence.shape
+        model = self
+        prior = np.ravel(prior).astype(float)
+        history: List[EMIteration] = []
+
+        for _ in range(iterations):
+            started = time.perf_counter()
+            states = model.states
+
+            # Expectation: forward messages shifted by one step line up each
+            # transition Xₜ₋₁ -> Xₜ with the backward message at step t
+            posteriors = np.empty((batch_size, steps, states))
+            log_likelihood = model._forward_sweep(evidence, active, prior, posteriors)
+            previous = np.concatenate(
+                (np.broadcast_to(prior, (batch_size, 1, states)), posteriors[:, :-1]),
+                axis=1,
+            )
+            backward_messages = np.empty_like(posteriors)
+            initial = model._backward_sweep(
+                evidence, active, posteriors, backward_messages
+            )
+
+            weighted = model.sensor_columns[evidence] * backward_messages
+            norms = np.einsum(
+                "bti,bti->bt", previous, weighted @ model.transition_model.T
+            )
+            previous *= np.where(active, 1.0 / norms, 0.0)[:, :, np.newaxis]
+            transition_counts = model.transition_model * np.einsum(
+                "bti,btj->ij", previous, weighted
+            )
+            sensor_counts = np.zeros((model.symbols, states))
+            np.add.at(sensor_counts, evidence[active], posteriors[active])
+
+            # Maximization, keeping the old rows of states that never occur
+            prior = normalize_rows(prior * initial).mean(axis=0)
+            transition_model = _normalize_counts(
+                transition_counts, model.transition_model
+            )
+            sensor_model = _normalize_counts(sensor_counts.T, model.sensor_model)
+            model = HMM(transition_model, sensor_model)
+
+            history.append(
+                EMIteration(
+                    log_likelihood=float(log_likelihood.sum()),
+                    seconds=time.perf_counter() - started,
+                )
+            )
+            if (
+                len(history) > 1
+                and history[-1].log_likelihood - history[-2].log_likelihood < tolerance
+            ):
+                break
+
+        return model, prior, history
+
+    def _forward_sweep(
+        self,
+        evidence: np.ndarray,
+        active: np.ndarray,
+        prior: np.ndarray,
+        out: np.ndarray,
+    ) -> np.ndarray:
+        # Writes the forward message of every step into out and returns the
+        # log likelihood of each evidence sequence
+        batch_size, steps = evidence.shape
+        message = _batch_prior(prior, batch_size, self.states)
+        log_likelihood = np.zeros(batch_size)
+        for t in range(steps):
+            # As defined in Russel Norvig Equation 15.12, one row per sequence
+            stepped = (message @ self.transition_model) * self.sensor_columns[
+                evidence[:, t]
+            ]
+            norms = stepped.sum(axis=1)
+            log_likelihood += np.where(active[:, t], np.log(norms), 0.0)
+            message = np.where(
+                active[:, t, np.newaxis], stepped / norms[:, np.newaxis], message
+            )
+            out[:, t] = message
+        return log_likelihood
+
+    def _backward_sweep(
+        self,
+        evidence: np.ndarray,
+        active: np.ndarray,
+        messages: np.ndarray,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        # Turns the forward messages into smoothed estimates in place,
+        # optionally keeping the backward messages, and returns the backward
+        # message for step 0
+        batch_size, steps = evidence.shape
+        backward_message = np.ones((batch_size, self.states))
+        for t in range(steps - 1, -1, -1):
+            if out is not None:
+                out[:, t] = backward_message
+            messages[:, t] = normalize_rows(messages[:, t] * backward_message)
+            # As defined in Russel Norvig Equation 15.13, one row per sequence
+            stepped = normalize_rows(
+                (self.sensor_columns[evidence[:, t]] * backward_message)
+                @ self.transition_model.T
+            )
+            backward_message = np.where(active[:, t, np.newaxis], stepped, 1.0)
+        return backward_message
+
+
+class EMIteration(NamedTuple):
+    """The log likelihood of the evidence under the model an EM iteration
+    started from, and the wall time the iteration took."""
+
+    log_likelihood: float
+    seconds: float
 
-    As defined in Russel Norvig Figure 15.4.
+
+def _padded_evidence(
+    evidence: np.ndarray, lengths: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Boolean evidence becomes the symbols 0 and 1, and the mask marks the
+    # valid steps of every sequence
+    evidence = np.asarray(evidence).astype(np.intp)
+    active = np.arange(evidence.shape[1]) < np.asarray(lengths)[:, np.newaxis]
+    return np.where(active, evidence, 0), active
+
+
+def _batch_prior(prior: np.ndarray, batch_size: int, states: int) -> np.ndarray:
+    return np.broadcast_to(
+        np.reshape(prior, (-1, states)), (batch_size, states)
+    ).astype(float)
+
+
+def _normalize_counts(counts: np.ndarray, fallback: np.ndarray) -> np.ndarray:
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.where(totals > 0, counts / np.where(totals > 0, totals, 1.0), fallback)
+
+
+UMBRELLA = HMM(UMBRELLA_TRANSITION, UMBRELLA_SENSOR)
+
+
+class Filter:
+    """Online filtering: the forward message is advanced one observation at a
+    time, so the evidence stream never has to be held in memory.
+    """
+
+    def __init__(self, hmm: HMM, prior: np.ndarray):
+        self.hmm: HMM = hmm
+        self.message: np.ndarray = prior
+        self.t: int = 0
+
+    def update(self, evidence: int) -> np.ndarray:
+        """Absorb the observation for step t + 1.
+
+        :param evidence: The evidence symbol observed at the next step
+        :return: The filtered estimate P(Xₜ | e₁, ..., eₜ)
+        """
+        self.message = self.hmm.forward(evidence, self.message)
+        self.t += 1
+        return self.message
+
+
+class FixedLagSmoother:
+    """Online fixed-lag smoothing, as in Russel Norvig Figure 15.6.
+
+    Instead of updating the backward matrix B with the inverses of the sensor
+    and transition models, the window product of the backward tables is kept
+    as a two-stack queue. Each step then costs O(1) amortized matrix products,
+    works for singular models, and does not accumulate inversion errors.
+    Memory is O(d) in the lag d.
+    """
+
+    def __init__(self, hmm: HMM, prior: np.ndarray, lag: int):
+        if lag < 0:
+            raise ValueError("lag must be non-negative")
+        self.hmm: HMM = hmm
+        self.lag: int = lag
+        self.t: int = 0
+        # The forward message for step t - d
+        self.message: np.ndarray = prior
+        # The evidence for steps t - d + 1, ..., t
+        self.window: Deque[int] = deque()
+        # Suffix products of the older part of the window, oldest on top
+        self._front: List[np.ndarray] = []
+        # Product of the newer part of the window, None when it is empty
+        self._back: Optional[np.ndarray] = None
+
+    def _window_product(self) -> np.ndarray:
+        if self._back is None:
+            return self._front[-1] if self._front else np.eye(self.hmm.states)
+        if not self._front:
+            return self._back
+        return self._front[-1] @ self._back
+
+    def _push(self, evidence: int) -> None:
+        table = self.hmm.backward_tables[evidence]
+        self._back = table if self._back is None else self._back @ table
+        self._back = self._back / self._back.max()
+
+    def _pop(self) -> None:
+        if not self._front:
+            product = np.eye(self.hmm.states)
+            for e in reversed(self.window):
+                product = self.hmm.backward_tables[e] @ product
+                product = product / product.max()
+                self._front.append(product)
+            self._back = None
+        self._front.pop()
+
+    def update(self, evidence: int) -> Optional[np.ndarray]:
+        """Absorb the observation for step t + 1.
+
+        :param evidence: The evidence symbol observed at the next step
+        :return: The smoothed estimate P(Xₜ₋d | e₁, ..., eₜ), or None while
+            fewer than d + 1 observations have been seen
+        """
+        evidence = int(evidence)
+        self.t += 1
+        self.window.append(evidence)
+        self._push(evidence)
+        if len(self.window) <= self.lag:
+            return None
+
+        self._pop()
+        self.message = self.hmm.forward(self.window.popleft(), self.message)
+        backward_message = self._window_product().sum(axis=1)
+        return normalize(self.message * backward_message.reshape(self.message.shape))
+
+    def flush(self) -> List[np.ndarray]:
+        """Smooth the last d steps once the evidence stream has ended.
+
+        :return: The smoothed estimates for steps t - d + 1, ..., t
+        """
+        forward_messages = [self.message]
+        for e in self.window:
+            forward_messages.append(self.hmm.forward(e, forward_messages[-1]))
+
+        smoothed_estimates = forward_messages[1:]
+        backward_message = np.ones_like(self.message, dtype=float)
+        for i in range(len(self.window) - 1, -1, -1):
+            smoothed_estimates[i] = normalize(
+                forward_messages[i + 1] * backward_message
+            )
+            backward_message = normalize(
+                self.hmm.backward(self.window[i], backward_message)
+            )
+        return smoothed_estimates
+
+
+def filtering(
+    hmm: HMM, evidence: Iterable[int], prior: np.ndarray
+) -> Iterator[np.ndarray]:
+    """Yield the filtered estimate for every observation as soon as it arrives.
+
+    :param hmm: The model
+    :param evidence: A possibly unbounded stream of evidence symbols
+    :param prior: The prior distribution on the initial state, P(X₀)
+    """
+    online_filter = Filter(hmm, prior)
+    for e in evidence:
+        yield online_filter.update(e)
+
+
+def fixed_lag_smoothing(
+    hmm: HMM, evidence: Iterable[int], prior: np.ndarray, lag: int
+) -> Iterator[np.ndarray]:
+    """Yield the smoothed estimate for every step, lagging d steps behind the
+    evidence stream. The last d estimates follow once the stream ends.
+
+    :param hmm: The model
+    :param evidence: A possibly unbounded stream of evidence symbols
+    :param prior: The prior distribution on the initial state, P(X₀)
+    :param lag: The number of steps d to look ahead before emitting
+    """
+    smoother = FixedLagSmoother(hmm, prior, lag)
+    for e in evidence:
+        estimate = smoother.update(e)
+        if estimate is not None:
+            yield estimate
+    yield from smoother.flush()
+
+
+def forward_backward(evidence: np.ndarray, prior: np.ndarray) -> List[np.ndarray]:
+    """The forward–backward algorithm for smoothing in the Umbrella domain.
 
     :param evidence: A vector of evidence values for steps 1, ..., t
     :param prior: The prior distribution on the initial state, P(X₀)
     :return: smoothed estimates
     """
-    # Model matrices
-    transition_model = np.array([[0.7, 0.3], [0.3, 0.7]])
-    u_true = np.array([[0.9, 0.0], [0.0, 0.2]])
-    u_false = np.array([[0.1, 0.0], [0.0, 0.8]])
-
-    # Initializing local variables for algorithm
-    forward_messages = [np.array([[0.0], [0.0]]) for _ in range((len(evidence) + 1))]
-    smoothed_estimates = [np.array([[0.0], [0.0]]) for _ in range(len(evidence))]
-    backward_message = np.array([[1.0], [1.0]])
-
-    # Here we pretty much follow the book
-    forward_messages[0] = prior
-    for t in range(1, len(evidence) + 1):
-        sensor_model = u_true if evidence[t - 1] else u_false
-        forward_messages[t] = forward(
-            sensor_model=sensor_model,
-            transition_model=transition_model,
-            message=forward_messages[t - 1],
-        )
-
-    # Uncomment following line for first backward_message, if desirable
-    # print(backward_message)
+    return UMBRELLA.forward_backward(evidence, prior)
 
-    for i in range(len(evidence) - 1, -1, -1):
-        smoothed_estimates[i] = normalize(forward_messages[i + 1] * backward_message)
-        sensor_model = u_true if evidence[i] else u_false
-        backward_message = backward(
-            sensor_model=sensor_model,
-            transition_model=transition_model,
-            message=backward_message,
-        )
 
-        # Uncomment following line for the remaining backward_messages, if desirable
-        # print(backward_message)
+def forward_backward_batch(
+    evidence: np.ndarray, lengths: np.ndarray, prior: np.ndarray
+) -> np.ndarray:
+    """Batched forward–backward smoothing in the Umbrella domain.
 
-    return smoothed_estimates
+    :param evidence: Padded (batch, T) array of evidence values
+    :param lengths: The number of valid steps of each sequence, shape (batch,)
+    :param prior: The prior distribution on the initial state, P(X₀)
+    :return: (batch, T, S) smoothed estimates, zero beyond each sequence end
+    """
+    return UMBRELLA.forward_backward_batch(evidence, lengths, prior)
 
 
 def main() -> None:
@@ -85,6 +571,22 @@ def main() -> None:
     for estimate in fb:
         print(estimate, end="\n\n")
 
+    batch = forward_backward_batch(
+        evidence=evidence[np.newaxis],
+        lengths=np.array([len(evidence)]),
+        prior=original_message,
+    )
+    print("Batched estimates:\n")
+    print(batch[0])
+
+    paths, _ = UMBRELLA.viterbi_batch(
+        evidence=evidence[np.newaxis],
+        lengths=np.array([len(evidence)]),
+        prior=original_message,
+    )
+    print("\nMost likely sequence (0 is rain):\n")
+    print(paths[0])
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# bayesnet.py: Bayesian and decision networks in the SMILE .xdsl format, with
+# exact inference by variable elimination.
+import itertools
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Mapping
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+# A state given as its id in the network or as its index
+State = Union[str, int]
+
+
+class Factor(NamedTuple):
+    """A table with one axis per variable, in the order of variables."""
+
+    variables: Tuple[str, ...]
+    table: np.ndarray
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    return vector / vector.sum()
+
+
+class BayesNet:
+    """A network of discrete chance, decision and utility nodes.
+
+    Every chance node has a CPT factor over its parents followed by itself, so
+    P(X = x | parents = p) is at cpts[X].table[p + (x,)]. Decision nodes have
+    states but no table, and utility nodes have a factor over their parents.
+    """
+
+    def __init__(self, name: str = "", numsamples: int = 1000):
+        self.name: str = name
+        # The number of samples the file asks approximate inference to draw
+        self.numsamples: int = numsamples
+        self.states: Dict[str, Tuple[str, ...]] = {}
+        self.parents: Dict[str, Tuple[str, ...]] = {}
+        self.cpts: Dict[str, Factor] = {}
+        self.decisions: List[str] = []
+        self.utilities: Dict[str, Factor] = {}
+        # Multi-attribute utility nodes: the weights of their utility parents
+        self.maus: Dict[str, Factor] = {}
+
+    def add_cpt(
+        self, variable: str, states: Sequence[str], parents: Sequence[str], cpt
+    ) -> None:
+        """
+        :param cpt: The probabilities in SMILE order, the states of variable
+            varying fastest and those of the first parent slowest
+        """
+        self._add_variable(variable, states, parents)
+        shape = tuple(len(self.states[p]) for p in parents) + (len(states),)
+        table = np.asarray(cpt, dtype=float).reshape(shape)
+        if not np.allclose(table.sum(axis=-1), 1):
+            raise ValueError(f"the distributions of {variable} must sum to 1")
+        self.cpts[variable] = Factor(tuple(parents) + (variable,), table)
+
+    def add_decision(
+        self, variable: str, states: Sequence[str], parents: Sequence[str] = ()
+    ) -> None:
+        """:param parents: The nodes observed before the decision is made"""
+        self._add_variable(variable, states, parents)
+        self.decisions.append(variable)
+
+    def add_utility(self, node: str, parents: Sequence[str], utilities) -> None:
+        shape = tuple(len(self.states[p]) for p in parents)
+        table = np.asarray(utilities, dtype=float).reshape(shape)
+        self.parents[node] = tuple(parents)
+        self.utilities[node] = Factor(tuple(parents), table)
+
+    def add_mau(self, node: str, parents: Sequence[str], weights) -> None:
+        weights = np.asarray(weights, dtype=float)
+        if weights.shape != (len(parents),):
+            raise ValueError(f"{node} needs one weight per parent")
+        self.parents[node] = tuple(parents)
+        self.maus[node] = Factor(tuple(parents), weights)
+
+    def _add_variable(
+        self, variable: str, states: Sequence[str], parents: Sequence[str]
+    ) -> None:
+        if variable in self.states:
+            raise ValueError(f"{variable} is defined twice")
+        for parent in parents:
+            if parent not in self.states:
+                raise ValueError(f"parent {parent} of {variable} is not defined")
+        self.states[variable] = tuple(states)
+        self.parents[variable] = tuple(parents)
+
+    def state_index(self, variable: str, state: State) -> int:
+        if isinstance(state, str):
+            return self.states[variable].index(state)
+        if not 0 <= state < len(self.states[variable]):
+            raise ValueError(f"{variable} has no state {state}")
+        return state
+
+    def leaves(self) -> List[str]:
+        """:return: The chance nodes that no chance or decision node has as a
+        parent, in the order of the file"""
+        parents = {p for v in self.states for p in self.parents[v]}
+        return [v for v in self.cpts if v not in parents]
+
+    def default_decisions(self) -> Dict[str, str]:
+        """:return: The first alternative of every decision, for queries that
+        need all decisions made"""
+        return {d: self.states[d][0] for d in self.decisions}
+
+    def ancestors(self, variables: Iterable[str]) -> Set[str]:
+        """:return: The variables and all their ancestors"""
+        found: Set[str] = set()
+        stack = list(variables)
+        while stack:
+            variable = stack.pop()
+            if variable not in found:
+                found.add(variable)
+                stack.extend(self.parents[variable])
+        return found
+
+    def factors(
+        self, evidence: Mapping[str, State], relevant: Set[str]
+    ) -> List[Factor]:
+        """The CPTs of the relevant chance nodes, reduced by the evidence.
+
+        Decision nodes among the relevant ones must be in the evidence.
+        """
+        for decision in self.decisions:
+            if decision in relevant and decision not in evidence:
+                raise ValueError(f"decision {decision} needs a value")
+        indices = {v: self.state_index(v, s) for v, s in evidence.items()}
+        return [
+            reduce(factor, indices)
+            for variable, factor in self.cpts.items()
+            if variable in relevant
+        ]
+
+    def query(
+        self,
+        variables: Union[str, Sequence[str]],
+        evidence: Optional[Mapping[str, State]] = None,
+    ) -> np.ndarray:
+        """The posterior distribution of some variables given the evidence.
+
+        Only the ancestors of the query and evidence variables take part, since
+        the other nodes sum out to 1. The rest are summed out by variable
+        elimination in min-fill order.
+
+        :param variables: One variable, or a sequence of them for their joint
+            distribution, with one axis per variable
+        :param evidence: The observed state of some variables, by id or index
+        """
+        single = isinstance(variables, str)
+        query = (variables,) if single else tuple(variables)
+        evidence = {} if evidence is None else evidence
+        for variable in itertools.chain(query, evidence):
+            if variable not in self.states:
+                raise ValueError(f"unknown variable {variable}")
+        if set(query) & set(evidence):
+            raise ValueError("a variable can not be both queried and observed")
+
+        factors = self.factors(evidence, self.ancestors(query + tuple(evidence)))
+        return normalize(variable_elimination(factors, query))
+
+
+def reduce(factor: Factor, evidence: Mapping[str, int]) -> Factor:
+    """Selects the observed states, dropping the axes of observed variables"""
+    if not any(variable in evidence for variable in factor.variables):
+        return factor
+    index = tuple(evidence.get(v, slice(None)) for v in factor.variables)
+    return Factor(
+        tuple(v for v in factor.variables if v not in evidence), factor.table[index]
+    )
+
+
+def multiply(factors: Sequence[Factor], variables: Sequence[str]) -> np.ndarray:
+    """The product of the factors, summed over every variable not in variables.
+
+    One einsum call does the product and the sums without building the full
+    table over every variable of the factors.
+    """
+    ids: Dict[str, int] = {}
+    operands: List = []
+    for factor in factors:
+        operands.append(factor.table)
+        operands.append([ids.setdefault(v, len(ids)) for v in factor.variables])
+    operands.append([ids[v] for v in variables])
+    return np.einsum(*operands)
+
+
+def min_fill_order(factors: Sequence[Factor], variables: Iterable[str]) -> List[str]:
+    """An elimination order for variables, greedily picking the variable that
+    adds the fewest new edges between its neighbours, then the one with the
+    fewest neighbours. Ties go to the first in sorted order.
+    """
+    neighbours: Dict[str, Set[str]] = {}
+    for factor in factors:
+        for variable in factor.variables:
+            neighbours.setdefault(variable, set()).update(factor.variables)
+    for variable, adjacent in neighbours.items():
+        adjacent.discard(variable)
+
+    def cost(variable: str) -> Tuple[int, int]:
+        adjacent = neighbours[variable]
+        fill = sum(
+            b not in neighbours[a] for a, b in itertools.combinations(adjacent, 2)
+        )
+        return fill, len(adjacent)
+
+    order = []
+    remaining = sorted(set(variables))
+    while remaining:
+        variable = min(remaining, key=cost)
+        remaining.remove(variable)
+        order.append(variable)
+        adjacent = neighbours.pop(variable)
+        for neighbour in adjacent:
+            neighbours[neighbour].discard(variable)
+            neighbours[neighbour].update(adjacent - {neighbour})
+    return order
+
+
+def variable_elimination(
+    factors: Sequence[Factor],
+    query: Sequence[str],
+    order: Optional[Sequence[str]] = None,
+) -> np.ndarray:
+    """Sums every variable but the query variables out of the product of the
+    factors, one variable at a time.
+
+    :param order: Elimination order of the other variables, min-fill if None
+    :return: Unnormalized table with one axis per query variable
+    """
+    factors = list(factors)
+    if order is None:
+        variables = {v for factor in factors for v in factor.variables}
+        order = min_fill_order(factors, variables - set(query))
+    for variable in order:
+        related = [f for f in factors if variable in f.variables]
+        factors = [f for f in factors if variable not in f.variables]
+        remaining = tuple(
+            dict.fromkeys(v for f in related for v in f.variables if v != variable)
+        )
+        factors.append(Factor(remaining, multiply(related, remaining)))
+    return multiply(factors, query)
+
+
+def load_xdsl(file: str) -> BayesNet:
+    """Reads the <cpt>, <decision>, <utility> and <mau> nodes of a SMILE file"""
+    root = ElementTree.parse(file).getroot()
+    network = BayesNet(
+        root.get("id", ""), int(root.get("numsamples", BayesNet().numsamples))
+    )
+    for node in root.find("nodes"):
+        node_id = node.get("id")
+        states = [state.get("id") for state in node.findall("state")]
+        parents = (node.findtext("parents") or "").split()
+        if node.tag == "cpt":
+            values = node.findtext("probabilities").split()
+            network.add_cpt(node_id, states, parents, [float(v) for v in values])
+        elif node.tag == "decision":
+            network.add_decision(node_id, states, parents)
+        elif node.tag == "utility":
+            values = node.findtext("utilities").split()
+            network.add_utility(node_id, parents, [float(v) for v in values])
+        elif node.tag == "mau":
+            values = node.findtext("weights").split()
+            network.add_mau(node_id, parents, [float(v) for v in values])
+        else:
+            raise ValueError(f"unsupported node type <{node.tag}>")
+    return network
+
+
+def main(file: str = "hiking.xdsl") -> None:
+    network = load_xdsl(file)
+    decisions = network.default_decisions()
+    given = "".join(f", {d} = {s}" for d, s in decisions.items())
+    for variable in network.cpts:
+        start = time.perf_counter()
+        posterior = network.query(variable, decisions)
+        elapsed = time.perf_counter() - start
+        print(
+            f"P({variable}{' |' if given else ''}{given[1:]}) ="
+            f" {np.round(posterior, 3)} in {elapsed * 1000:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
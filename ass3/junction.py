@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# junction.py: Junction trees compiled once from a network, for answering
+# queries against a stream of evidence.
+import functools
+import itertools
+import sys
+import time
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+import numpy as np
+
+from bayesnet import BayesNet
+from bayesnet import Factor
+from bayesnet import State
+from bayesnet import load_xdsl
+from bayesnet import min_fill_order
+from bayesnet import multiply
+from bayesnet import normalize
+
+Edge = Tuple[int, int]
+
+
+class JunctionTree:
+    """A junction tree of a network with cached Shafer-Shenoy messages.
+
+    The cliques come from triangulating the moral graph in min-fill order, and
+    every CPT is multiplied into one clique potential once, on construction.
+    Messages are computed when a marginal needs them and kept until evidence
+    changes. Evidence on a variable only invalidates the messages flowing away
+    from the clique it is entered in, so a new observation recomputes the part
+    of the tree between that clique and the queried one.
+
+    Decision nodes get a uniform factor. As it does not depend on the parents,
+    observing a decision is the same as fixing it, so decisions are set as
+    evidence like any other variable.
+    """
+
+    def __init__(self, network: BayesNet, cache_size: int = 1024):
+        """:param cache_size: Evidence sets kept by the marginals cache"""
+        self.states: Dict[str, Tuple[str, ...]] = network.states
+        self._state_index = network.state_index
+        factors = list(network.cpts.values()) + [
+            Factor((d,), np.full(len(network.states[d]), 1 / len(network.states[d])))
+            for d in network.decisions
+        ]
+
+        self.cliques: List[Tuple[str, ...]] = _cliques(factors)
+        self.neighbours: List[List[int]] = [[] for _ in self.cliques]
+        self.separators: Dict[Edge, Tuple[str, ...]] = {}
+        for i, j in _spanning_tree(self.cliques):
+            separator = tuple(v for v in self.cliques[i] if v in self.cliques[j])
+            self.neighbours[i].append(j)
+            self.neighbours[j].append(i)
+            self.separators[i, j] = self.separators[j, i] = separator
+
+        # Every variable lives in its smallest clique, where factors and
+        # evidence on it are entered and its marginal is read
+        self.home: Dict[str, int] = {
+            v: min(
+                (c for c, clique in enumerate(self.cliques) if v in clique),
+                key=lambda c: len(self.cliques[c]),
+            )
+            for v in self.states
+        }
+        self.potentials: List[np.ndarray] = [
+            np.ones(tuple(len(self.states[v]) for v in clique))
+            for clique in self.cliques
+        ]
+        for factor in factors:
+            c = next(
+                c for c, k in enumerate(self.cliques) if set(factor.variables) <= set(k)
+            )
+            self.potentials[c] = multiply(
+                [Factor(self.cliques[c], self.potentials[c]), factor], self.cliques[c]
+            )
+
+        # upstream[i, j] holds the cliques whose evidence the message from i to
+        # j depends on: those on the side of i when the edge is cut
+        self.upstream: Dict[Edge, Set[int]] = {
+            edge: self._side(*edge) for edge in self.separators
+        }
+        self.evidence: Dict[str, int] = {}
+        self.messages: Dict[Edge, np.ndarray] = {}
+        self._marginals_cached = functools.lru_cache(maxsize=cache_size)(
+            self._marginals
+        )
+
+    def _side(self, i: int, j: int) -> Set[int]:
+        side = {i}
+        stack = [i]
+        while stack:
+            c = stack.pop()
+            for n in self.neighbours[c]:
+                if n != j and n not in side:
+                    side.add(n)
+                    stack.append(n)
+        return side
+
+    def set_evidence(self, evidence: Mapping[str, State]) -> None:
+        """Replaces the evidence, invalidating only messages that depend on
+        the variables whose observation changed"""
+        indices = {v: self._state_index(v, s) for v, s in evidence.items()}
+        changed = {
+            self.home[v]
+            for v in set(indices) | set(self.evidence)
+            if indices.get(v) != self.evidence.get(v)
+        }
+        if changed:
+            self.messages = {
+                edge: message
+                for edge, message in self.messages.items()
+                if not changed & self.upstream[edge]
+            }
+        self.evidence = indices
+
+    def _incoming(self, c: int, exclude: int = -1) -> List[Factor]:
+        # The potential of clique c with its evidence and its messages
+        factors = [Factor(self.cliques[c], self.potentials[c])]
+        for variable, index in self.evidence.items():
+            if self.home[variable] == c:
+                likelihood = np.zeros(len(self.states[variable]))
+                likelihood[index] = 1
+                factors.append(Factor((variable,), likelihood))
+        for n in self.neighbours[c]:
+            if n != exclude:
+                factors.append(Factor(self.separators[n, c], self._message(n, c)))
+        return factors
+
+    def _message(self, i: int, j: int) -> np.ndarray:
+        message = self.messages.get((i, j))
+        if message is None:
+            message = multiply(self._incoming(i, exclude=j), self.separators[i, j])
+            # Scaling does not change the marginals, and keeps long chains of
+            # small probabilities from underflowing
+            total = message.sum()
+            message = message / total if total > 0 else message
+            self.messages[i, j] = message
+        return message
+
+    def marginal(self, variable: str) -> np.ndarray:
+        """P(variable | evidence)"""
+        c = self.home[variable]
+        return normalize(multiply(self._incoming(c), (variable,)))
+
+    def _marginals(
+        self, evidence: Tuple[Tuple[str, int], ...]
+    ) -> Dict[str, np.ndarray]:
+        # The evidence is only the cache key: it is already set
+        marginals = {v: self.marginal(v) for v in self.states}
+        for marginal in marginals.values():
+            marginal.flags.writeable = False
+        return marginals
+
+    def marginals(
+        self, evidence: Mapping[str, State], cache: bool = True
+    ) -> Dict[str, np.ndarray]:
+        """The marginal of every variable given the evidence. With cache, they
+        are kept in an LRU cache keyed on the evidence, so a repeated evidence
+        set is a dictionary lookup. The arrays are read-only, as they are shared.
+        The evidence is set either way, so marginal agrees with them afterwards.
+        """
+        key = tuple(sorted((v, self._state_index(v, s)) for v, s in evidence.items()))
+        self.set_evidence(dict(key))
+        return self._marginals_cached(key) if cache else self._marginals(key)
+
+
+def _cliques(factors: Sequence[Factor]) -> List[Tuple[str, ...]]:
+    # The maximal cliques of the moral graph triangulated in min-fill order.
+    # Eliminating a variable makes a clique of it and its neighbours.
+    variables = list(dict.fromkeys(v for f in factors for v in f.variables))
+    neighbours: Dict[str, Set[str]] = {v: set() for v in variables}
+    for factor in factors:
+        for a, b in itertools.combinations(factor.variables, 2):
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+    cliques: List[Set[str]] = []
+    for variable in min_fill_order(factors, variables):
+        clique = neighbours[variable] | {variable}
+        if not any(clique <= other for other in cliques):
+            cliques.append(clique)
+        for neighbour in neighbours[variable]:
+            neighbours[neighbour] |= neighbours[variable] - {neighbour}
+            neighbours[neighbour].discard(variable)
+        del neighbours[variable]
+    order = {v: i for i, v in enumerate(variables)}
+    return [tuple(sorted(clique, key=order.get)) for clique in cliques]
+
+
+def _spanning_tree(cliques: Sequence[Tuple[str, ...]]) -> List[Edge]:
+    # Kruskal's algorithm for a maximum spanning tree with separator sizes as
+    # weights, which has the running intersection property
+    component = list(range(len(cliques)))
+
+    def find(c: int) -> int:
+        while component[c] != c:
+            component[c] = component[component[c]]
+            c = component[c]
+        return c
+
+    pairs = sorted(
+        itertools.combinations(range(len(cliques)), 2),
+        key=lambda e: -len(set(cliques[e[0]]) & set(cliques[e[1]])),
+    )
+    edges = []
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            component[root_i] = root_j
+            edges.append((i, j))
+    return edges
+
+
+def main(file: str = "hiking.xdsl", queries: str = "10000") -> None:
+    network = load_xdsl(file)
+    # Every possible observation of the leaves, with every combination of
+    # decisions
+    leaves = network.leaves()
+    assignments = []
+    for decided in itertools.product(*(network.states[d] for d in network.decisions)):
+        decisions = dict(zip(network.decisions, decided))
+        joint = network.query(leaves, decisions)
+        for index in zip(*np.nonzero(joint)):
+            assignments.append(dict(decisions, **dict(zip(leaves, map(int, index)))))
+    rng = np.random.default_rng(0)
+    stream = [assignments[i] for i in rng.integers(0, len(assignments), int(queries))]
+
+    start = time.perf_counter()
+    tree = JunctionTree(network)
+    print(
+        f"Compiled {len(tree.cliques)} cliques in {time.perf_counter() - start:.4f} s"
+    )
+
+    def eliminate(evidence: Mapping[str, State]) -> None:
+        for variable in network.states:
+            if variable not in evidence and variable not in network.decisions:
+                network.query(variable, evidence)
+
+    for name, run in (
+        ("Variable elimination", eliminate),
+        ("Junction tree, cold", lambda e: tree.marginals(e, cache=False)),
+        ("Junction tree, warm", tree.marginals),
+    ):
+        start = time.perf_counter()
+        for evidence in stream:
+            run(evidence)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {len(stream) / elapsed:.0f} evidence sets per second")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
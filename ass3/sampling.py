@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+# sampling.py: Approximate inference by likelihood weighting and Gibbs
+# sampling, drawing every sample of a shard at once and spreading the shards
+# over a process pool.
+import concurrent.futures
+import sys
+import time
+from typing import List
+from typing import Mapping
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from bayesnet import BayesNet
+from bayesnet import State
+from bayesnet import load_xdsl
+from bayesnet import normalize
+
+
+class Estimate(NamedTuple):
+    # The estimated distribution, with one axis per query variable
+    distribution: np.ndarray
+    # Effective sample size: the number of independent exact samples that
+    # would give an estimate of about the same variance
+    ess: float
+    samples: int
+
+
+class _Shard(NamedTuple):
+    # Unnormalized weighted counts of the query states and the statistics the
+    # effective sample size of the merged shards needs
+    counts: np.ndarray
+    weight_sum: float
+    square_sum: float
+    ess: float
+    samples: int
+
+
+def _indices(
+    network: BayesNet, evidence: Mapping[str, State]
+) -> Tuple[List[str], dict]:
+    for decision in network.decisions:
+        if decision not in evidence:
+            raise ValueError(f"decision {decision} needs a value")
+    # network.states is in the order of the file, where parents come first
+    order = list(network.states)
+    return order, {v: network.state_index(v, s) for v, s in evidence.items()}
+
+
+def _draw(probabilities: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    # One draw from each row of a (rows, states) array of probabilities,
+    # normalized or not
+    cumulative = np.cumsum(probabilities, axis=1)
+    u = rng.random(len(probabilities)) * cumulative[:, -1]
+    return np.minimum(
+        (cumulative < u[:, np.newaxis]).sum(axis=1), probabilities.shape[1] - 1
+    )
+
+
+def weighted_samples(
+    network: BayesNet,
+    evidence: Mapping[str, State],
+    samples: int,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Likelihood weighting, one variable at a time for all samples.
+
+    :return: (samples, variables) array of state indices, in the order of
+        network.states, and the weight of every sample
+    """
+    order, observed = _indices(network, evidence)
+    states = np.empty((samples, len(order)), dtype=np.intp)
+    weights = np.ones(samples)
+    column = {v: i for i, v in enumerate(order)}
+    for variable in order:
+        if variable in observed:
+            states[:, column[variable]] = observed[variable]
+            if variable in network.cpts:
+                factor = network.cpts[variable]
+                weights *= factor.table[
+                    tuple(states[:, column[p]] for p in factor.variables)
+                ]
+        else:
+            factor = network.cpts[variable]
+            rows = factor.table[
+                tuple(states[:, column[p]] for p in factor.variables[:-1])
+            ]
+            states[:, column[variable]] = _draw(
+                np.broadcast_to(rows, (samples, rows.shape[-1])), rng
+            )
+    return states, weights
+
+
+def _query_codes(
+    network: BayesNet, query: Tuple[str, ...], states: np.ndarray
+) -> Tuple[np.ndarray, Tuple[int, ...]]:
+    column = {v: i for i, v in enumerate(network.states)}
+    shape = tuple(len(network.states[v]) for v in query)
+    codes = np.ravel_multi_index(tuple(states[..., column[v]] for v in query), shape)
+    return codes, shape
+
+
+def _likelihood_shard(
+    seed: np.random.SeedSequence,
+    network: BayesNet,
+    query: Tuple[str, ...],
+    evidence: Mapping[str, State],
+    samples: int,
+) -> _Shard:
+    states, weights = weighted_samples(
+        network, evidence, samples, np.random.default_rng(seed)
+    )
+    codes, shape = _query_codes(network, query, states)
+    counts = np.bincount(codes, weights=weights, minlength=int(np.prod(shape)))
+    weight_sum = float(weights.sum())
+    square_sum = float((weights**2).sum())
+    ess = weight_sum**2 / square_sum if square_sum > 0 else 0.0
+    return _Shard(counts, weight_sum, square_sum, ess, samples)
+
+
+def _gibbs_shard(
+    seed: np.random.SeedSequence,
+    network: BayesNet,
+    query: Tuple[str, ...],
+    evidence: Mapping[str, State],
+    samples: int,
+    chains: Optional[int] = None,
+    burn_in: int = 100,
+) -> _Shard:
+    # By default every chain gets at least 250 draws, with 4 to 100 chains:
+    # short chains make their autocorrelation, and so the ESS, unreliable
+    if chains is None:
+        chains = min(max(samples // 250, 4), 100)
+    rng = np.random.default_rng(seed)
+    order, observed = _indices(network, evidence)
+    column = {v: i for i, v in enumerate(order)}
+    # Every chain starts from a likelihood weighted sample drawn by weight, so
+    # it starts in a state with positive probability
+    start, weights = weighted_samples(network, evidence, 10 * chains, rng)
+    if weights.sum() == 0:
+        raise ValueError("no sample has positive weight for the evidence")
+    states = start[rng.choice(len(start), chains, p=normalize(weights))]
+
+    # The Markov blanket of each variable: the CPT of the variable and those
+    # of its children, each as (table, parents, position of the variable)
+    blankets = {
+        variable: [
+            (factor.table, factor.variables, factor.variables.index(variable))
+            for factor in network.cpts.values()
+            if variable in factor.variables
+        ]
+        for variable in order
+        if variable not in observed
+    }
+    draws = -(-samples // chains)
+    codes = np.empty((chains, draws), dtype=np.intp)
+    shape = tuple(len(network.states[v]) for v in query)
+    for sweep in range(burn_in + draws):
+        for variable, factors in blankets.items():
+            size = len(network.states[variable])
+            probabilities = np.ones((chains, size))
+            for table, variables, position in factors:
+                index = [states[:, column[v], np.newaxis] for v in variables]
+                index[position] = np.arange(size)[np.newaxis]
+                probabilities *= table[tuple(index)]
+            states[:, column[variable]] = _draw(probabilities, rng)
+        if sweep >= burn_in:
+            codes[:, sweep - burn_in] = _query_codes(network, query, states)[0]
+
+    counts = np.bincount(codes.ravel(), minlength=int(np.prod(shape))).astype(float)
+    return _Shard(
+        counts, float(codes.size), float(codes.size), _chain_ess(codes), codes.size
+    )
+
+
+def _chain_ess(codes: np.ndarray) -> float:
+    """Effective sample size of (chains, draws) states, for the indicator of
+    every state, with the smallest over the states reported.
+
+    Every chain is split in half, so a chain that has not mixed shows up as
+    halves that disagree. The autocorrelation combines the autocovariance
+    within the chains with the variance between their means, so it is
+    measured against the mean over all chains, and it is summed in pairs of
+    lags until a pair goes negative, Geyer's initial positive sequence, as
+    in Stan.
+    """
+    draws = codes.shape[1] // 2
+    if draws < 2:
+        return float(codes.size)
+    halves = np.concatenate((codes[:, :draws], codes[:, draws : 2 * draws]))
+    chains = len(halves)
+    smallest = float(codes.size)
+    for state in np.unique(halves):
+        indicator = (halves == state).astype(float)
+        means = indicator.mean(axis=1)
+        centered = indicator - means[:, np.newaxis]
+        # Autocovariance of every chain at every lag, by FFT
+        size = 2 ** int(np.ceil(np.log2(2 * draws)))
+        spectrum = np.fft.rfft(centered, size, axis=1)
+        autocovariance = np.fft.irfft(spectrum * spectrum.conj(), size, axis=1)
+        autocovariance = autocovariance[:, :draws].mean(axis=0) / draws
+        within = autocovariance[0] * draws / (draws - 1)
+        between = means.var(ddof=1) if chains > 1 else 0.0
+        variance = (draws - 1) / draws * within + between
+        if variance == 0:
+            continue
+        rho = 1 - (within - autocovariance) / variance
+        rho[0] = 1.0
+        pairs = rho[: len(rho) // 2 * 2].reshape(-1, 2).sum(axis=1)
+        positive = np.argmax(pairs <= 0) if (pairs <= 0).any() else len(pairs)
+        # The pair sums of a reversible chain decrease, so noise is cut down
+        pairs = np.minimum.accumulate(pairs[:positive])
+        correlation_time = max(
+            -1 + 2 * pairs.sum(), 1 / np.log10(max(chains * draws, 10))
+        )
+        smallest = min(smallest, chains * draws / correlation_time)
+    return smallest
+
+
+SAMPLERS = {"likelihood": _likelihood_shard, "gibbs": _gibbs_shard}
+
+
+def sample(
+    network: BayesNet,
+    variables: Union[str, Sequence[str]],
+    evidence: Optional[Mapping[str, State]] = None,
+    samples: Optional[int] = None,
+    method: str = "likelihood",
+    seed: Optional[int] = None,
+    shard_size: int = 100000,
+    workers: Optional[int] = None,
+) -> Estimate:
+    """Estimates the posterior distribution of some variables by sampling.
+
+    The samples are split into shards of at most shard_size, and each shard
+    gets its own seed spawned from seed, so the estimate does not depend on
+    the number of workers. More than one shard runs in a process pool.
+
+    :param samples: Number of samples, the numsamples of the network if None
+    :param method: "likelihood" weighting or "gibbs" sampling
+    :param workers: Number of worker processes, default one per core
+    """
+    query = (variables,) if isinstance(variables, str) else tuple(variables)
+    evidence = {} if evidence is None else evidence
+    if samples is None:
+        samples = network.numsamples
+    shards = max(1, -(-samples // shard_size))
+    sizes = [samples // shards + (i < samples % shards) for i in range(shards)]
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    sampler = SAMPLERS[method]
+
+    if shards == 1 or workers == 1:
+        results = [
+            sampler(s, network, query, evidence, n) for s, n in zip(seeds, sizes)
+        ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    sampler,
+                    seeds,
+                    [network] * shards,
+                    [query] * shards,
+                    [evidence] * shards,
+                    sizes,
+                )
+            )
+
+    counts = sum(r.counts for r in results)
+    shape = tuple(len(network.states[v]) for v in query)
+    if method == "likelihood":
+        square_sum = sum(r.square_sum for r in results)
+        ess = (
+            sum(r.weight_sum for r in results) ** 2 / square_sum if square_sum else 0.0
+        )
+    else:
+        # The chains of different shards are independent
+        ess = sum(r.ess for r in results)
+    return Estimate(
+        normalize(counts).reshape(shape), ess, sum(r.samples for r in results)
+    )
+
+
+def main(file: str = "hiking.xdsl") -> None:
+    network = load_xdsl(file)
+    # A root given the most likely observation of the leaves, which likelihood
+    # weighting only reaches through the weights
+    query = next((v for v in network.cpts if not network.parents[v]), None)
+    query = next(iter(network.cpts)) if query is None else query
+    evidence = network.default_decisions()
+    leaves = [v for v in network.leaves() if v != query]
+    if leaves:
+        joint = network.query(leaves, evidence)
+        likely = np.unravel_index(joint.argmax(), joint.shape)
+        evidence.update(zip(leaves, (int(i) for i in likely)))
+    print(f"P({query} | {', '.join(evidence) or '-'})")
+    print(f"Exact:      {np.round(network.query(query, evidence), 4)}")
+    for method in SAMPLERS:
+        for samples in (network.numsamples, 100 * network.numsamples):
+            begin = time.perf_counter()
+            estimate = sample(network, query, evidence, samples, method, seed=4171)
+            elapsed = time.perf_counter() - begin
+            print(
+                f"{method:>10}: {np.round(estimate.distribution, 4)}"
+                f" from {estimate.samples} samples, ESS {estimate.ess:.0f},"
+                f" {elapsed:.3f} s"
+            )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# utility.py: Expected utility and optimal policies for a decision in a
+# decision network.
+import itertools
+import sys
+import time
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+from bayesnet import BayesNet
+from bayesnet import Factor
+from bayesnet import State
+from bayesnet import load_xdsl
+from bayesnet import multiply
+from bayesnet import reduce
+from bayesnet import variable_elimination
+
+
+class Policy:
+    """The best alternative of a decision for every combination of states of
+    the variables observed before it is made."""
+
+    def __init__(
+        self,
+        network: BayesNet,
+        decision: str,
+        observed: Tuple[str, ...],
+        expected_utilities: np.ndarray,
+    ):
+        """
+        :param expected_utilities: Expected utility of alternative d after the
+            observations o at [o + (d,)], nan if the observations are impossible
+        """
+        self.decision: str = decision
+        self.observed: Tuple[str, ...] = observed
+        self.alternatives: Tuple[str, ...] = network.states[decision]
+        self.expected_utilities: np.ndarray = expected_utilities
+        self.best: np.ndarray = np.where(
+            np.isnan(expected_utilities), -np.inf, expected_utilities
+        ).argmax(axis=-1)
+        # The policy keyed on the observed states, for decisions by lookup
+        self.table: Dict[Tuple[str, ...], str] = {
+            observation: self.alternatives[self.best[index]]
+            for index, observation in zip(
+                np.ndindex(self.best.shape),
+                itertools.product(*(network.states[v] for v in observed)),
+            )
+        }
+
+    def decide(self, observation: Mapping[str, str]) -> str:
+        """:return: The best alternative given the observed states"""
+        return self.table[tuple(observation[v] for v in self.observed)]
+
+
+def total_utility(network: BayesNet) -> Factor:
+    """The utility of the network as one factor: the weighted sum of the
+    parents of its multi-attribute utility node, or the sum of its utility
+    nodes if it has none"""
+    if len(network.maus) > 1:
+        raise ValueError("only one multi-attribute utility node is supported")
+    if network.maus:
+        (mau,) = network.maus.values()
+        terms = list(zip(mau.table, (network.utilities[u] for u in mau.variables)))
+    else:
+        terms = [(1.0, factor) for factor in network.utilities.values()]
+    if not terms:
+        raise ValueError("the network has no utility nodes")
+
+    variables = tuple(dict.fromkeys(v for _, f in terms for v in f.variables))
+    table = np.zeros(tuple(len(network.states[v]) for v in variables))
+    for weight, factor in terms:
+        ones = [
+            Factor((v,), np.ones(len(network.states[v])))
+            for v in variables
+            if v not in factor.variables
+        ]
+        table += weight * multiply([factor] + ones, variables)
+    return Factor(variables, table)
+
+
+def solve(
+    network: BayesNet,
+    decision: Optional[str] = None,
+    observed: Optional[Sequence[str]] = None,
+    evidence: Optional[Mapping[str, State]] = None,
+) -> Policy:
+    """The expected utility of every alternative of a decision given every
+    combination of observations, and the policy maximizing it.
+
+    The decision enters the elimination as a variable with a factor of ones,
+    so each elimination covers every alternative and observation at once.
+    One gives the probabilities of the observations, and one the utility.
+
+    :param decision: The decision to make, the only one in the network if None
+    :param observed: The variables known when deciding, by default the
+        parents of the decision
+    :param evidence: States of other variables, including any other decisions
+    """
+    if decision is None:
+        if len(network.decisions) != 1:
+            raise ValueError("the network needs exactly one decision to default to")
+        decision = network.decisions[0]
+    if decision not in network.decisions:
+        raise ValueError(f"{decision} is not a decision")
+    observed = tuple(network.parents[decision] if observed is None else observed)
+    evidence = {} if evidence is None else evidence
+    if decision in evidence or set(observed) & set(evidence):
+        raise ValueError("the decision and observed variables can not be evidence")
+
+    utility = total_utility(network)
+    relevant = network.ancestors(
+        utility.variables + observed + (decision,) + tuple(evidence)
+    )
+    others = set(network.decisions) - {decision} - set(evidence)
+    if others & relevant:
+        raise ValueError(f"decisions {sorted(others & relevant)} need values")
+    indices = {v: network.state_index(v, s) for v, s in evidence.items()}
+    factors: List[Factor] = [
+        reduce(factor, indices)
+        for variable, factor in network.cpts.items()
+        if variable in relevant
+    ] + [Factor((decision,), np.ones(len(network.states[decision])))]
+
+    query = observed + (decision,)
+    probability = variable_elimination(factors, query)
+    expected = variable_elimination(factors + [reduce(utility, indices)], query)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected_utilities = np.where(probability > 0, expected / probability, np.nan)
+    return Policy(network, decision, observed, expected_utilities)
+
+
+def main(file: str = "hiking.xdsl", decisions: str = "100000") -> None:
+    network = load_xdsl(file)
+    if not network.decisions:
+        print(f"{file} has no decisions")
+        return
+    # Every decision observing nothing, and then one more of the leaves it
+    # does not affect at a time, with the other decisions at their first
+    # alternatives
+    defaults = network.default_decisions()
+    for decision in network.decisions:
+        leaves = [v for v in network.leaves() if decision not in network.ancestors([v])]
+        evidence = {d: s for d, s in defaults.items() if d != decision}
+        for count in range(len(leaves) + 1):
+            observed = tuple(leaves[:count])
+            start = time.perf_counter()
+            policy = solve(network, decision, observed, evidence)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{decision}, observing {', '.join(observed) or 'nothing'}"
+                f" ({elapsed * 1000:.2f} ms):"
+            )
+            for observation, best in policy.table.items():
+                index = tuple(
+                    network.states[v].index(s) for v, s in zip(observed, observation)
+                )
+                utilities = np.round(policy.expected_utilities[index], 1)
+                print(f"  {', '.join(observation) or '-'}: {best}, EU {utilities}")
+
+    observations = [
+        dict(zip(policy.observed, observation)) for observation in policy.table
+    ]
+    stream = [observations[i % len(observations)] for i in range(int(decisions))]
+    start = time.perf_counter()
+    for observation in stream:
+        policy.decide(observation)
+    elapsed = time.perf_counter() - start
+    print(f"{len(stream) / elapsed:.0f} decisions per second by lookup")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -6,50 +6,100 @@
 # Date: 20.04.2016
 # Updates in 2020 just for fun
 
-import random
-import math
-import statistics
+import copy
 import functools
+import os
+import random
+import struct
+import tempfile
 from typing import Any
+from typing import Callable
+from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Tuple
+from typing import Union
 
-VALUE_OPTIONS = {1, 2}
+import numpy as np
 
 
 class Dataset:
-    def __init__(self, examples: List[Tuple[List[int], int]]):
-        self.examples: List[Tuple[List[int], int]] = examples
+    """Examples stored column-wise: one 2-D integer feature array and one label
+    array, shared by every subset. A subset only holds the indices of its rows,
+    so splitting a node never copies the examples.
+
+    The value domain of every attribute and the set of classes are learned
+    from the data, and both are encoded as dense codes for counting.
+    """
+
+    def __init__(self, features: np.ndarray, labels: np.ndarray):
+        self.all_features: np.ndarray = features
+        self.all_labels: np.ndarray = labels
+        self.indices: np.ndarray = np.arange(len(labels))
+
+        self.domains: List[np.ndarray] = []
+        self.codes: np.ndarray = np.empty(features.shape, dtype=np.intp)
+        for attribute in range(features.shape[1]):
+            domain, codes = np.unique(features[:, attribute], return_inverse=True)
+            self.domains.append(domain)
+            self.codes[:, attribute] = codes
+        self.classes, self.label_codes = np.unique(labels, return_inverse=True)
 
     @classmethod
     def from_file(cls, file_path: str) -> "Dataset":
-        return cls(examples=load_dataset(file_path))
+        return cls(*load_dataset(file_path))
+
+    def __len__(self) -> int:
+        return len(self.indices)
 
     @property
-    def features(self) -> List[List[int]]:
-        return [e[0] for e in self.examples]
+    def features(self) -> np.ndarray:
+        return self.all_features[self.indices]
 
     @property
-    def labels(self) -> List[int]:
-        return [e[1] for e in self.examples]
+    def labels(self) -> np.ndarray:
+        return self.all_labels[self.indices]
+
+    def column(self, attribute: int) -> np.ndarray:
+        return self.all_features[self.indices, attribute]
+
+    def subset(self, indices: np.ndarray) -> "Dataset":
+        view = copy.copy(self)
+        view.indices = indices
+        return view
+
+    def partition(self, attribute: int) -> Dict[int, "Dataset"]:
+        """Split the rows on their value of attribute, with one stable sort.
+        Only values that occur among the rows get a subset."""
+        column = self.column(attribute)
+        order = np.argsort(column, kind="stable")
+        values, starts = np.unique(column[order], return_index=True)
+        return {
+            int(v): self.subset(rows)
+            for v, rows in zip(values, np.split(self.indices[order], starts[1:]))
+        }
 
 
 class Node:
-    def __init__(self, ndtype: str, attribute: int = -1):
+    def __init__(self, ndtype: str, attribute: int = -1, default: int = 0):
         self.ndtype: str = ndtype
         self.attribute: int = attribute
-        self.children: List[Node] = []
+        # Test nodes only have children for the values seen in training, and
+        # classify every other value as default
+        self.children: Dict[int, Node] = {}
+        self.default: int = default
 
     def __str__(self):
         return "\n".join(self.tree_strings())
 
     def classify_example(self, example: List[int]) -> int:
-        if self.ndtype == "test":
-            return self.children[example[self.attribute] - 1].classify_example(example)
-        elif self.ndtype == "1":
-            return 1
-        else:
-            return 2
+        node = self
+        while node.ndtype == "test":
+            child = node.children.get(example[node.attribute])
+            if child is None:
+                return node.default
+            node = child
+        return int(node.ndtype)
 
     def node_string(self) -> str:
         prstr = f"NODE({self.ndtype})"
@@ -58,82 +108,264 @@ class Node:
         return prstr
 
     def tree_strings(self) -> List[str]:
-        child_strings = [f"\t{s}" for c in self.children for s in c.tree_strings()]
+        child_strings = [
+            f"\t{s}" for _, c in sorted(self.children.items()) for s in c.tree_strings()
+        ]
         return [self.node_string(), *child_strings]
 
 
-def plurality_value(examples: List[Tuple[List[int], int]]) -> Node:
-    labels = [e[1] for e in examples]
-    plurality_class = statistics.mode(labels)
-    return Node(str(plurality_class))
-
+class CompiledTree:
+    """A Node tree flattened into parallel arrays, numbered breadth first.
+
+    Node i tests attribute feature[i], or is a leaf when feature[i] is -1. Its
+    children are child_nodes[child_offsets[i]:child_offsets[i + 1]], reached
+    by the values in the same slice of child_values, sorted. value[i] is the
+    class of a leaf, or the default class of a test node.
+
+    Edge e, the child of parent node p for value v, has edge_keys[e] =
+    p * (high - low + 1) + v - low, where low and high are the smallest and
+    largest child value, so the keys are sorted and one searchsorted finds
+    the child of every row at once. A single leaf has the one key -1, which
+    never matches.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        value: np.ndarray,
+        child_offsets: np.ndarray,
+        child_values: np.ndarray,
+        child_nodes: np.ndarray,
+        edge_keys: Optional[np.ndarray] = None,
+        value_range: Optional[Tuple[int, int]] = None,
+    ):
+        """
+        :param edge_keys: The keys of the edges, computed from child_values if
+            None. Given along with value_range when loading a tree file, so no
+            edge has to be read up front.
+        :param value_range: low and high, computed from child_values if None
+        """
+        self.feature: np.ndarray = feature
+        self.value: np.ndarray = value
+        self.child_offsets: np.ndarray = child_offsets
+        self.child_values: np.ndarray = child_values
+        self.child_nodes: np.ndarray = child_nodes
+
+        if value_range is None:
+            value_range = (
+                (int(child_values.min()), int(child_values.max()))
+                if len(child_values)
+                else (0, 0)
+            )
+        self.low: int
+        self.high: int
+        self.low, self.high = value_range
+        self._stride = self.high - self.low + 1
+        if edge_keys is None:
+            parents = np.repeat(np.arange(len(feature)), np.diff(child_offsets))
+            edge_keys = parents * self._stride + (child_values - self.low)
+            if not len(edge_keys):
+                edge_keys = np.array([-1])
+        self.edge_keys: np.ndarray = edge_keys
 
-def uniform_class(examples: List[Tuple[List[int], int]]) -> bool:
-    labels = [e[1] for e in examples]
-    return len(set(labels)) == 1
+    @classmethod
+    def from_node(cls, tree: Node) -> "CompiledTree":
+        nodes = [tree]
+        child_offsets = [0]
+        child_values: List[int] = []
+        for node in nodes:
+            for value, child in sorted(node.children.items()):
+                child_values.append(value)
+                nodes.append(child)
+            child_offsets.append(len(child_values))
+
+        is_test = [node.ndtype == "test" for node in nodes]
+        return cls(
+            feature=np.array(
+                [n.attribute if t else -1 for n, t in zip(nodes, is_test)], np.int64
+            ),
+            value=np.array(
+                [n.default if t else int(n.ndtype) for n, t in zip(nodes, is_test)],
+                np.int64,
+            ),
+            child_offsets=np.array(child_offsets, np.int64),
+            child_values=np.array(child_values, np.int64),
+            child_nodes=np.arange(1, len(nodes), dtype=np.int64),
+        )
 
+    def __str__(self):
+        return "\n".join(self.tree_strings())
 
-def b(q: float) -> float:
-    if q in [0, 1]:
-        return 0
-    return -(q * math.log(q, 2) + (1 - q) * math.log((1 - q), 2))
+    def tree_strings(self, node: int = 0) -> List[str]:
+        """The same rendering as Node.tree_strings, for debugging."""
+        if self.feature[node] < 0:
+            return [f"NODE({self.value[node]})"]
+        children = self.child_nodes[
+            self.child_offsets[node] : self.child_offsets[node + 1]
+        ]
+        child_strings = [f"\t{s}" for c in children for s in self.tree_strings(c)]
+        return [f"NODE(test): {self.feature[node]}", *child_strings]
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Classify every row of a 2-D feature array, descending one tree level
+        for all rows at a time."""
+        features = np.asarray(features)
+        predictions = np.empty(len(features), dtype=self.value.dtype)
+        rows = np.arange(len(features))
+        nodes = np.zeros(len(features), dtype=np.int64)
+
+        while len(rows):
+            attributes = self.feature[nodes]
+            values = features[rows, np.maximum(attributes, 0)]
+            keys = nodes * self._stride + (values - self.low)
+            edges = np.searchsorted(self.edge_keys, keys)
+            edges[edges == len(self.edge_keys)] = 0
+            found = (
+                (attributes >= 0)
+                & (values >= self.low)
+                & (values <= self.high)
+                & (self.edge_keys[edges] == keys)
+            )
 
+            # Leaves, and test nodes without a child for the value, are done
+            predictions[rows[~found]] = self.value[nodes[~found]]
+            rows = rows[found]
+            nodes = self.child_nodes[edges[found]]
 
-def set_entropy(examples: List[Tuple[List[int], int]]) -> float:
-    p = 0
-    for e in examples:
-        if e[1] == 1:
-            p += 1
-    return b(p / len(examples))
+        return predictions
 
 
-def importance_entropy(attribute: int, examples: List[Tuple[List[int], int]]) -> float:
-    goal = set_entropy(examples)
-    value_splits = [
-        [e for e in examples if e[0][attribute] == v] for v in VALUE_OPTIONS
-    ]
-    remainder = sum(
-        (len(split) / len(examples)) * set_entropy(split) for split in value_splits
+def plurality_class(examples: Dataset) -> int:
+    # Ties go to the label seen first, like statistics.mode
+    labels, first_seen, counts = np.unique(
+        examples.labels, return_index=True, return_counts=True
     )
-    gain = goal - remainder
+    candidates = np.flatnonzero(counts == counts.max())
+    return int(labels[candidates[np.argmin(first_seen[candidates])]])
+
+
+def plurality_value(examples: Dataset) -> Node:
+    return Node(str(plurality_class(examples)))
+
+
+def uniform_class(examples: Dataset) -> bool:
+    labels = examples.labels
+    return bool((labels == labels[0]).all())
+
+
+def entropy(counts: np.ndarray) -> np.ndarray:
+    """The entropy, in bits, of the distributions given by counts along the
+    last axis. Empty distributions have zero entropy."""
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = counts / np.where(totals > 0, totals, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(p > 0, p * np.log2(p), 0.0)
+    return -terms.sum(axis=-1)
+
+
+def gini(counts: np.ndarray) -> np.ndarray:
+    """The Gini impurity of the distributions given by counts along the last
+    axis. Empty distributions have zero impurity."""
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = counts / np.where(totals > 0, totals, 1)
+    return np.where(totals[..., 0] > 0, 1.0 - (p**2).sum(axis=-1), 0.0)
+
+
+def split_counts(attributes: List[int], examples: Dataset) -> np.ndarray:
+    """Contingency counts of value and class for every attribute, from a single
+    bincount over the examples. Attributes with fewer values than the largest
+    domain get all-zero rows for the missing ones.
+
+    :return: (len(attributes), values, classes) array of example counts
+    """
+    values = max(len(examples.domains[a]) for a in attributes)
+    classes = len(examples.classes)
+    codes = examples.codes[np.ix_(examples.indices, attributes)]
+    cells = (np.arange(len(attributes)) * values + codes) * classes
+    cells += examples.label_codes[examples.indices, np.newaxis]
+    counts = np.bincount(cells.ravel(), minlength=len(attributes) * values * classes)
+    return counts.reshape(len(attributes), values, classes)
+
+
+def impurity_decrease(
+    impurity_fn: Callable[[np.ndarray], np.ndarray],
+    attributes: List[int],
+    examples: Dataset,
+) -> np.ndarray:
+    counts = split_counts(attributes, examples)
+    goal = impurity_fn(counts[0].sum(axis=0))
+    remainder = (counts.sum(axis=2) / len(examples) * impurity_fn(counts)).sum(axis=1)
+    return goal - remainder
+
+
+def importance_entropy(attributes: List[int], examples: Dataset) -> np.ndarray:
+    gain = impurity_decrease(entropy, attributes, examples)
     return gain
 
 
-def importance_random(attribute: Any, examples: Any) -> float:
-    del attribute
+def importance_gini(attributes: List[int], examples: Dataset) -> np.ndarray:
+    return impurity_decrease(gini, attributes, examples)
+
+
+def importance_random(
+    attributes: List[int],
+    examples: Any,
+    rng: Optional[np.random.Generator] = None,
+) -> np.ndarray:
     del examples
-    return random.random()
+    if rng is not None:
+        return rng.random(len(attributes))
+    return np.array([random.random() for _ in attributes])
+
+
+IMPORTANCE_FUNCTIONS = {"entropy": importance_entropy, "gini": importance_gini}
 
 
 def decision_tree_learning(
-    examples: List[Tuple[List[int], int]],
+    examples: Dataset,
     considered_attributes: List[int],
-    parent_examples: List[Tuple[List[int], int]],
+    parent_examples: Optional[Dataset],
     random_importance: bool = False,
+    criterion: str = "entropy",
+    max_features: Optional[int] = None,
+    rng: Optional[np.random.Generator] = None,
 ) -> Node:
-    importance_fn = importance_random if random_importance else importance_entropy
+    """
+    :param max_features: If given, every split only scores this many of the
+        considered attributes, drawn at random
+    :param rng: The source of randomness for random importance and attribute
+        sampling. Random importance falls back on the random module without it
+    """
+    importance_fn = (
+        functools.partial(importance_random, rng=rng)
+        if random_importance
+        else IMPORTANCE_FUNCTIONS[criterion]
+    )
 
     if len(examples) == 0:
         return plurality_value(parent_examples)
 
     elif uniform_class(examples):
-        return Node(str(examples[0][1]))
+        return Node(str(examples.all_labels[examples.indices[0]]))
 
     elif len(considered_attributes) == 0:
         return plurality_value(examples)
 
     else:
-        most_significant_attribute = max(
-            considered_attributes,
-            key=functools.partial(importance_fn, examples=examples),
+        candidates = considered_attributes
+        if max_features is not None and max_features < len(candidates):
+            if rng is None:
+                rng = np.random.default_rng()
+            candidates = sorted(rng.choice(candidates, max_features, replace=False))
+        importances = importance_fn(candidates, examples)
+        most_significant_attribute = int(candidates[int(np.argmax(importances))])
+        tree = Node(
+            "test", most_significant_attribute, default=plurality_class(examples)
         )
-        tree = Node("test", most_significant_attribute)
-
-        for value in VALUE_OPTIONS:
-            value_examples = [
-                e for e in examples if e[0][most_significant_attribute] == value
-            ]
 
+        for value, value_examples in examples.partition(
+            most_significant_attribute
+        ).items():
             subtree = decision_tree_learning(
                 examples=value_examples,
                 considered_attributes=[
@@ -141,80 +373,144 @@ def decision_tree_learning(
                 ],
                 parent_examples=examples,
                 random_importance=random_importance,
+                criterion=criterion,
+                max_features=max_features,
+                rng=rng,
             )
 
-            tree.children.append(subtree)
+            tree.children[value] = subtree
 
         return tree
 
 
-def load_dataset(file_path: str) -> List[Tuple[List[int], int]]:
-    examples = []
-    with open(file_path, "r") as f:
-        for line in f:
-            example = [int(n) for n in line.rstrip("\n").split("\t")]
-            examples.append((example[:-1], example[-1]))
-    return examples
+def load_dataset(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    table = np.loadtxt(file_path, dtype=np.int64, delimiter="\t", ndmin=2)
+    return table[:, :-1], table[:, -1]
 
 
-def write_tree(tree: Node, file: str) -> None:
+def write_tree(tree: Union[Node, CompiledTree], file: str) -> None:
     with open(file, "w") as f:
         f.write(str(tree))
 
 
+# Binary tree files: the magic bytes, the format version, the number of nodes,
+# the number of edges, and low and high, followed by the CompiledTree arrays
+# as little-endian int64 in the order feature, value, child_offsets,
+# child_values, child_nodes and edge_keys
+TREE_MAGIC = b"DTREE\0\0\0"
+TREE_VERSION = 1
+_TREE_HEADER = struct.Struct("<8sQQQqq")
+
+
+def save_tree(tree: CompiledTree, file: str) -> None:
+    with open(file, "wb") as f:
+        f.write(
+            _TREE_HEADER.pack(
+                TREE_MAGIC,
+                TREE_VERSION,
+                len(tree.feature),
+                len(tree.child_values),
+                tree.low,
+                tree.high,
+            )
+        )
+        for array in (
+            tree.feature,
+            tree.value,
+            tree.child_offsets,
+            tree.child_values,
+            tree.child_nodes,
+            tree.edge_keys,
+        ):
+            f.write(np.ascontiguousarray(array, dtype="<i8").tobytes())
+
+
+def load_tree(file: str, mmap: bool = True) -> CompiledTree:
+    """Load a tree written by save_tree. With mmap the arrays are read-only
+    views of the memory-mapped file, so no node is read until it is used."""
+    with open(file, "rb") as f:
+        header = f.read(_TREE_HEADER.size)
+    if not header.startswith(TREE_MAGIC) or len(header) < _TREE_HEADER.size:
+        raise ValueError(f"{file} is not a tree file")
+    _, version, nodes, edges, low, high = _TREE_HEADER.unpack(header)
+    if version != TREE_VERSION:
+        raise ValueError(f"{file} has unsupported tree format version {version}")
+
+    # A single leaf has one edge key
+    count = 3 * nodes + 1 + 2 * edges + max(edges, 1)
+    if mmap:
+        data = np.memmap(
+            file, dtype="<i8", mode="r", offset=_TREE_HEADER.size, shape=(count,)
+        )
+    else:
+        data = np.fromfile(file, dtype="<i8", count=count, offset=_TREE_HEADER.size)
+    arrays = np.split(data, np.cumsum([nodes, nodes, nodes + 1, edges, edges]))
+    return CompiledTree(*arrays, value_range=(low, high))
+
+
+def check_tree_file(tree: Node, features: np.ndarray) -> None:
+    """Check that a tree saved with save_tree and loaded again with load_tree
+    classifies every row of features like the tree itself. The file is written
+    to a temporary directory and removed afterwards.
+
+    :raises RuntimeError: If any prediction differs
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, "tree.bin")
+        save_tree(CompiledTree.from_node(tree), file)
+        predictions = load_tree(file, mmap=False).predict(features)
+    expected = [tree.classify_example(example) for example in features]
+    if not np.array_equal(predictions, expected):
+        raise RuntimeError("the saved tree classifies differently")
+
+
 def main() -> None:
     training_set = Dataset.from_file("training.txt")
     test_set = Dataset.from_file("test.txt")
     attributes = [0, 1, 2, 3, 4, 5, 6]
     tree_rnd = decision_tree_learning(
-        examples=training_set.examples,
+        examples=training_set,
         considered_attributes=attributes,
-        parent_examples=[],
+        parent_examples=None,
         random_importance=True,
     )
     tree_ent = decision_tree_learning(
-        examples=training_set.examples,
+        examples=training_set,
         considered_attributes=attributes,
-        parent_examples=[],
+        parent_examples=None,
         random_importance=False,
     )
 
     write_tree(tree_rnd, "rndtree.txt")
     write_tree(tree_ent, "enttree.txt")
+    check_tree_file(tree_ent, test_set.features)
 
     errs = []
     for i in range(100):
         tree_rnd = decision_tree_learning(
-            examples=training_set.examples,
+            examples=training_set,
             considered_attributes=attributes,
-            parent_examples=[],
+            parent_examples=None,
             random_importance=True,
         )
-        rc = 0
-        for e in test_set.examples:
-            if e[1] != tree_rnd.classify_example(e[0]):
-                rc += 1
-        errs.append(rc)
+        predictions = CompiledTree.from_node(tree_rnd).predict(test_set.features)
+        errs.append(int((predictions != test_set.labels).sum()))
     print(f"Low: {min(errs)}")
     print(f"Average: {sum(errs) / len(errs)}")
     print(f"High: {max(errs)}")
 
-    rc = 0
-    ec = 0
+    rnd_predictions = CompiledTree.from_node(tree_rnd).predict(test_set.features)
+    ent_predictions = CompiledTree.from_node(tree_ent).predict(test_set.features)
+    rc = int((rnd_predictions != test_set.labels).sum())
+    ec = int((ent_predictions != test_set.labels).sum())
     print("Rnd:\tEnt:")
-    for e in test_set.examples:
-        if e[1] != tree_rnd.classify_example(e[0]):
-            rc += 1
-        if e[1] != tree_ent.classify_example(e[0]):
-            ec += 1
-        print(
-            f"{e[1]}{tree_rnd.classify_example(e[0])}\t{e[1]}{tree_ent.classify_example(e[0])}"
-        )
+    for label, rnd, ent in zip(test_set.labels, rnd_predictions, ent_predictions):
+        print(f"{label}{rnd}\t{label}{ent}")
     print()
     print("Total error:")
     print(f"{rc}\t{ec}")
     print("of\tof")
-    print(f"{len(test_set.examples)}\t{len(test_set.examples)}")
+    print(f"{len(test_set)}\t{len(test_set)}")
 
 
 if __name__ == "__main__":
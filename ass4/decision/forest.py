@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# forest.py: Bagged ensembles of decision trees, trained in a process pool.
+
+import concurrent.futures
+import contextlib
+import sys
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from decision import CompiledTree
+from decision import Dataset
+from decision import decision_tree_learning
+
+# The training set of a worker process, sent once when the pool starts
+_worker_examples: Optional[Dataset] = None
+
+
+class RandomForest:
+    def __init__(
+        self, trees: List[CompiledTree], classes: np.ndarray, oob_error: float
+    ):
+        self.trees: List[CompiledTree] = trees
+        self.classes: np.ndarray = classes
+        # Error rate of the out-of-bag votes on the training examples
+        self.oob_error: float = oob_error
+
+    def votes(self, features: np.ndarray) -> np.ndarray:
+        """:return: (rows, classes) array counting the trees voting for each"""
+        features = np.asarray(features)
+        votes = np.zeros((len(features), len(self.classes)), dtype=np.int64)
+        for tree in self.trees:
+            _add_votes(
+                votes, np.arange(len(features)), tree.predict(features), self.classes
+            )
+        return votes
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Majority vote of the trees. Ties go to the smallest class."""
+        return self.classes[self.votes(features).argmax(axis=1)]
+
+
+def random_forest(
+    examples: Dataset,
+    attributes: List[int],
+    n_trees: int = 100,
+    max_features: Optional[int] = None,
+    random_importance: bool = False,
+    criterion: str = "entropy",
+    seed: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> RandomForest:
+    """Train a random forest: every tree learns from a bootstrap sample of the
+    examples and scores a random subset of the attributes at each split.
+
+    Each tree gets its own seed spawned from seed, so the forest does not
+    depend on the number of workers or the order they finish in. The trees
+    predict their own out-of-bag examples in the workers, which gives the
+    out-of-bag error without another pass over the training set.
+
+    :param max_features: Attributes scored per split, default √len(attributes)
+    :param seed: Seed for the whole forest, fresh entropy if None
+    :param workers: Number of worker processes, default one per core. With
+        one, the trees are grown in this process.
+    """
+    if max_features is None:
+        max_features = max(1, round(np.sqrt(len(attributes))))
+    seeds = np.random.SeedSequence(seed).spawn(n_trees)
+
+    trees: List[CompiledTree] = []
+    oob_votes = np.zeros((len(examples), len(examples.classes)), dtype=np.int64)
+    arguments = (
+        seeds,
+        [attributes] * n_trees,
+        [max_features] * n_trees,
+        [random_importance] * n_trees,
+        [criterion] * n_trees,
+    )
+    with contextlib.ExitStack() as stack:
+        if workers == 1:
+            _init_worker(examples)
+            results = map(_grow_tree, *arguments)
+        else:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker, initargs=(examples,)
+                )
+            )
+            results = executor.map(_grow_tree, *arguments)
+        for tree, oob_rows, oob_predictions in results:
+            trees.append(tree)
+            _add_votes(oob_votes, oob_rows, oob_predictions, examples.classes)
+
+    voted = oob_votes.sum(axis=1) > 0
+    oob_labels = examples.classes[oob_votes[voted].argmax(axis=1)]
+    oob_error = (
+        float((oob_labels != examples.labels[voted]).mean())
+        if voted.any()
+        else float("nan")
+    )
+    return RandomForest(trees, examples.classes, oob_error)
+
+
+def _add_votes(
+    votes: np.ndarray, rows: np.ndarray, predictions: np.ndarray, classes: np.ndarray
+) -> None:
+    codes = np.searchsorted(classes, predictions)
+    votes += np.bincount(rows * len(classes) + codes, minlength=votes.size).reshape(
+        votes.shape
+    )
+
+
+def _init_worker(examples: Dataset) -> None:
+    global _worker_examples
+    _worker_examples = examples
+
+
+def _grow_tree(
+    seed: np.random.SeedSequence,
+    attributes: List[int],
+    max_features: int,
+    random_importance: bool,
+    criterion: str,
+) -> Tuple[CompiledTree, np.ndarray, np.ndarray]:
+    examples = _worker_examples
+    rng = np.random.default_rng(seed)
+    bootstrap = rng.integers(0, len(examples), len(examples))
+    tree = CompiledTree.from_node(
+        decision_tree_learning(
+            examples=examples.subset(examples.indices[bootstrap]),
+            considered_attributes=attributes,
+            parent_examples=None,
+            random_importance=random_importance,
+            criterion=criterion,
+            max_features=max_features,
+            rng=rng,
+        )
+    )
+    oob = np.flatnonzero(np.bincount(bootstrap, minlength=len(examples)) == 0)
+    return tree, oob, tree.predict(examples.all_features[examples.indices[oob]])
+
+
+def main(workers: Optional[int] = None) -> None:
+    training_set = Dataset.from_file("training.txt")
+    test_set = Dataset.from_file("test.txt")
+    attributes = [0, 1, 2, 3, 4, 5, 6]
+    forest = random_forest(
+        training_set, attributes, n_trees=100, seed=4171, workers=workers
+    )
+    errors = int((forest.predict(test_set.features) != test_set.labels).sum())
+    print(f"Out-of-bag error: {forest.oob_error:.3f}")
+    print(f"Test error: {errors} of {len(test_set)}")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -1,15 +1,19 @@
-import math
 import random
-import copy
 
-# The transfer function of neurons, g(x)
+import numpy as np
+
+import activation
+
+
+# The transfer function of neurons, g(x). Works on scalars and arrays.
 def logFunc(x):
-    return 1.0 / (1.0 + math.exp(-x))
+    return activation.sigmoid(x)
 
 
-# The derivative of the transfer function, g'(x)
+# The derivative of the transfer function, g'(x). The network itself uses
+# activation.sigmoidDerivative on the activations it already computed.
 def logFuncDerivative(x):
-    return math.exp(-x) / (pow(math.exp(-x) + 1, 2))
+    return activation.sigmoidDerivative(activation.sigmoid(x))
 
 
 def randomFloat(low, high):
@@ -24,115 +28,223 @@ def makeMatrix(I, J):
     return m
 
 
+class PairActivations:
+    # Activation levels of every layer for a batch of pattern pairs (A, B),
+    # one row per pair. Inputs include the bias node.
+    def __init__(self, batchSize, numInputs, numHidden):
+        self.inputsA = np.empty((batchSize, numInputs))
+        self.hiddenA = np.empty((batchSize, numHidden))
+        self.outputA = np.empty(batchSize)
+        self.inputsB = np.empty((batchSize, numInputs))
+        self.hiddenB = np.empty((batchSize, numHidden))
+        self.outputB = np.empty(batchSize)
+
+
 class NN:  # Neural Network
-    def __init__(self, numInputs, numHidden, learningRate=0.001):
+    def __init__(self, numInputs, numHidden, learningRate=0.001, rng=None):
         # Inputs: number of input and hidden nodes. Assuming a single output node.
         # +1 for bias node: A node with a constant input of 1. Used to shift the transfer function.
+        # rng: A numpy Generator for the initial weights. Without it, they come from the global random module.
         self.numInputs = numInputs + 1
         self.numHidden = numHidden
 
         # Current activation levels for nodes (in other words, the nodes' output value)
-        self.inputActivation = [1.0] * self.numInputs
-        self.hiddenActivations = [1.0] * self.numHidden
+        self.inputActivation = np.ones(self.numInputs)
+        self.hiddenActivations = np.ones(self.numHidden)
         self.outputActivation = 1.0  # Assuming a single output.
         self.learningRate = learningRate
+        # The transfer function of the forward pass
+        self.transfer = activation.sigmoid
 
-        # create weights
+        # create weights, set to random values
+        draw = randomFloat if rng is None else rng.uniform
         # A matrix with all weights from input layer to hidden layer
-        self.weightsInput = makeMatrix(self.numInputs, self.numHidden)
-        # A list with all weights from hidden layer to the single output neuron.
-        self.weightsOutput = [
-            0 for i in range(self.numHidden)
-        ]  # Assuming single output
-        # set them to random vaules
-        for i in range(self.numInputs):
-            for j in range(self.numHidden):
-                self.weightsInput[i][j] = randomFloat(-0.5, 0.5)
-        for j in range(self.numHidden):
-            self.weightsOutput[j] = randomFloat(-0.5, 0.5)
+        self.weightsInput = np.array(
+            [
+                [draw(-0.5, 0.5) for j in range(self.numHidden)]
+                for i in range(self.numInputs)
+            ]
+        )
+        # A vector with all weights from hidden layer to the single output neuron.
+        self.weightsOutput = np.array([draw(-0.5, 0.5) for j in range(self.numHidden)])
 
         # Data for the backpropagation step in RankNets.
         # For storing the previous activation levels (output levels) of all neurons
-        self.prevInputActivations = []
-        self.prevHiddenActivations = []
+        self.prevInputActivations = np.ones(self.numInputs)
+        self.prevHiddenActivations = np.ones(self.numHidden)
         self.prevOutputActivation = 0
         # For storing the previous delta in the output and hidden layer
         self.prevDeltaOutput = 0
-        self.prevDeltaHidden = [0 for i in range(self.numHidden)]
+        self.prevDeltaHidden = np.zeros(self.numHidden)
         # For storing the current delta in the same layers
         self.deltaOutput = 0
-        self.deltaHidden = [0 for i in range(self.numHidden)]
+        self.deltaHidden = np.zeros(self.numHidden)
+
+    # The stateless part of the network: these only read the weights, so any
+    # number of threads can score and compute gradients against one network.
+
+    def forwardInto(self, patterns, inputs, hidden, output):
+        # Propagates a batch of patterns, writing the activations into the
+        # given buffers
+        inputs[:, :-1] = patterns
+        inputs[:, -1] = 1  # Set bias node to 1.
+        np.matmul(inputs, self.weightsInput, out=hidden)
+        self.transfer(hidden, out=hidden)
+        np.matmul(hidden, self.weightsOutput, out=output)
+        self.transfer(output, out=output)
+        return output
+
+    def score(self, patterns, out=None):
+        # Returns the output activation for every row of a batch of patterns
+        patterns = np.asarray(patterns, dtype=float)
+        if patterns.shape[1:] != (self.numInputs - 1,):
+            raise ValueError("wrong number of inputs")
+        if out is None:
+            out = np.empty(len(patterns))
+        inputs = np.empty((len(patterns), self.numInputs))
+        hidden = np.empty((len(patterns), self.numHidden))
+        return self.forwardInto(patterns, inputs, hidden, out)
+
+    def forwardPair(self, patternsA, patternsB, activations=None):
+        # Propagates a batch of pairs. Pass preallocated PairActivations of the
+        # same batch size to avoid allocating new ones.
+        patternsA = np.asarray(patternsA, dtype=float)
+        patternsB = np.asarray(patternsB, dtype=float)
+        if patternsA.shape[1:] != (self.numInputs - 1,) or (
+            patternsA.shape != patternsB.shape
+        ):
+            raise ValueError("wrong number of inputs")
+        if activations is None or len(activations.outputA) != len(patternsA):
+            activations = PairActivations(
+                len(patternsA), self.numInputs, self.numHidden
+            )
+        a = activations
+        self.forwardInto(patternsA, a.inputsA, a.hiddenA, a.outputA)
+        self.forwardInto(patternsB, a.inputsB, a.hiddenB, a.outputB)
+        return activations
+
+    def outputDeltas(self, outputA, outputB):
+        # The RankNet deltas of the output layer, where A should rank above B.
+        # The derivatives come from the output activations, g' = g(1 - g).
+        probAB = activation.sigmoid(outputA - outputB)
+        return (
+            activation.sigmoidDerivative(outputA) * (1.0 - probAB),
+            activation.sigmoidDerivative(outputB) * (1.0 - probAB),
+        )
+
+    def hiddenDeltas(self, hiddenA, hiddenB, deltaOutputA, deltaOutputB):
+        outputDeltaDifference = np.multiply.outer(
+            deltaOutputA - deltaOutputB, self.weightsOutput
+        )
+        return (
+            activation.sigmoidDerivative(hiddenA) * outputDeltaDifference,
+            activation.sigmoidDerivative(hiddenB) * outputDeltaDifference,
+        )
+
+    def weightUpdates(
+        self,
+        inputsA,
+        hiddenA,
+        deltaOutputA,
+        deltaHiddenA,
+        inputsB,
+        hiddenB,
+        deltaOutputB,
+        deltaHiddenB,
+    ):
+        # The weight changes for one pair, or summed over a batch of pairs
+        def summed(activations, deltas):
+            activations = np.reshape(activations, (-1, np.shape(activations)[-1]))
+            return activations.T @ np.reshape(deltas, (len(activations), -1))
+
+        return (
+            self.learningRate
+            * (summed(inputsA, deltaHiddenA) - summed(inputsB, deltaHiddenB)),
+            self.learningRate
+            * (summed(hiddenA, deltaOutputA) - summed(hiddenB, deltaOutputB))[:, 0],
+        )
+
+    def pairWeightUpdates(self, activations):
+        a = activations
+        deltaOutputA, deltaOutputB = self.outputDeltas(a.outputA, a.outputB)
+        deltaHiddenA, deltaHiddenB = self.hiddenDeltas(
+            a.hiddenA, a.hiddenB, deltaOutputA, deltaOutputB
+        )
+        return self.weightUpdates(
+            a.inputsA,
+            a.hiddenA,
+            deltaOutputA,
+            deltaHiddenA,
+            a.inputsB,
+            a.hiddenB,
+            deltaOutputB,
+            deltaHiddenB,
+        )
+
+    def trainBatch(self, patternsA, patternsB, activations=None):
+        # The RankNet update for a mini-batch of pairs where A should rank above
+        # B, summed over the pairs. For a single pair this is exactly
+        # propagate(A), propagate(B), backpropagate().
+        activations = self.forwardPair(patternsA, patternsB, activations)
+        updateInput, updateOutput = self.pairWeightUpdates(activations)
+        self.weightsInput += updateInput
+        self.weightsOutput += updateOutput
+        return activations
+
+    # The stateful interface of the exercise: propagate A, propagate B, and
+    # backpropagate, with the network remembering the previous pattern.
 
     def propagate(self, inputs):
         if len(inputs) != self.numInputs - 1:
             raise ValueError("wrong number of inputs")
 
-        # input activations
-        self.prevInputActivations = copy.deepcopy(self.inputActivation)
-        for i in range(self.numInputs - 1):
-            self.inputActivation[i] = inputs[i]
-        self.inputActivation[-1] = 1  # Set bias node to -1.
-
-        # hidden activations
-        self.prevHiddenActivations = copy.deepcopy(self.hiddenActivations)
-        for j in range(self.numHidden):
-            sum = 0.0
-            for i in range(self.numInputs):
-                # print self.ai[i] ," * " , self.wi[i][j]
-                sum = sum + self.inputActivation[i] * self.weightsInput[i][j]
-            self.hiddenActivations[j] = logFunc(sum)
-
-        # output activations
+        # The current activations become the previous ones. The buffers are
+        # swapped rather than copied and overwritten in place.
+        self.prevInputActivations, self.inputActivation = (
+            self.inputActivation,
+            self.prevInputActivations,
+        )
+        self.prevHiddenActivations, self.hiddenActivations = (
+            self.hiddenActivations,
+            self.prevHiddenActivations,
+        )
         self.prevOutputActivation = self.outputActivation
-        sum = 0.0
-        for j in range(self.numHidden):
-            sum = sum + self.hiddenActivations[j] * self.weightsOutput[j]
-        self.outputActivation = logFunc(sum)
+        output = np.empty(1)
+        self.forwardInto(
+            np.asarray(inputs, dtype=float),
+            self.inputActivation[np.newaxis],
+            self.hiddenActivations[np.newaxis],
+            output,
+        )
+        self.outputActivation = output[0]
         return self.outputActivation
 
     def computeOutputDelta(self):
-        # Implement the delta function for the output layer (see exercise text)
-        probAB = 1.0 / (
-            1.0 + math.exp(-(self.prevOutputActivation - self.outputActivation))
-        )
-        self.prevDeltaOutput = logFuncDerivative(self.prevOutputActivation) * (
-            1.0 - probAB
+        self.prevDeltaOutput, self.deltaOutput = self.outputDeltas(
+            self.prevOutputActivation, self.outputActivation
         )
-        self.deltaOutput = logFuncDerivative(self.outputActivation) * (1.0 - probAB)
 
     def computeHiddenDelta(self):
-        # Implement the delta function for the hidden layer (see exercise text)
-        for i in range(self.numHidden):
-            self.prevDeltaHidden[i] = (
-                logFuncDerivative(self.prevHiddenActivations[i])
-                * self.weightsOutput[i]
-                * (self.prevDeltaOutput - self.deltaOutput)
-            )
-            self.deltaHidden[i] = (
-                logFuncDerivative(self.hiddenActivations[i])
-                * self.weightsOutput[i]
-                * (self.prevDeltaOutput - self.deltaOutput)
-            )
+        self.prevDeltaHidden, self.deltaHidden = self.hiddenDeltas(
+            self.prevHiddenActivations,
+            self.hiddenActivations,
+            self.prevDeltaOutput,
+            self.deltaOutput,
+        )
 
     def updateWeights(self):
-        # TODO: Update the weights of the network using the deltas (see exercise text)
-        for i in range(self.numInputs):
-            for j in range(self.numHidden):
-                self.weightsInput[i][j] = self.weightsInput[i][j] + (
-                    self.learningRate
-                    * (
-                        (self.prevDeltaHidden[j] * self.prevInputActivations[i])
-                        - (self.deltaHidden[j] * self.inputActivation[i])
-                    )
-                )
-        for i in range(self.numHidden):
-            self.weightsOutput[i] = self.weightsOutput[i] + (
-                self.learningRate
-                * (
-                    (self.prevDeltaOutput * self.prevHiddenActivations[i])
-                    - (self.deltaOutput * self.hiddenActivations[i])
-                )
-            )
+        updateInput, updateOutput = self.weightUpdates(
+            self.prevInputActivations,
+            self.prevHiddenActivations,
+            self.prevDeltaOutput,
+            self.prevDeltaHidden,
+            self.inputActivation,
+            self.hiddenActivations,
+            self.deltaOutput,
+            self.deltaHidden,
+        )
+        self.weightsInput += updateInput
+        self.weightsOutput += updateOutput
 
     def backpropagate(self):
         self.computeOutputDelta()
@@ -148,39 +260,59 @@ class NN:  # Neural Network
         print("Output weights:")
         print(self.weightsOutput)
 
-    def train(self, patterns, iterations=1):
+    # Saves the weights and learning rate in numpy's binary .npz format. Extra
+    # keyword arrays are stored in the same file.
+    def save(self, file, **extra):
+        np.savez(
+            file,
+            weightsInput=self.weightsInput,
+            weightsOutput=self.weightsOutput,
+            learningRate=self.learningRate,
+            **extra,
+        )
+
+    # Loads a network stored with save
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            weightsInput = data["weightsInput"]
+            nn = cls(
+                weightsInput.shape[0] - 1,
+                weightsInput.shape[1],
+                float(data["learningRate"]),
+                rng=np.random.default_rng(0),
+            )
+            nn.weightsInput[:] = weightsInput
+            nn.weightsOutput[:] = data["weightsOutput"]
+        return nn
+
+    def train(self, patterns, iterations=1, batchSize=1):
         # Train the network on all patterns for a number of iterations.
         # To measure performance each iteration: Run for 1 iteration, then count misordered pairs.
         # Training is done  like this (details in exercise text):
         # -Propagate A
         # -Propagate B
         # -Backpropagate
+        # Pairs are processed batchSize at a time, with batchSize=1 giving the
+        # same updates as doing the steps above for one pair at a time.
+        patternsA = np.array([pattern[0] for pattern in patterns], dtype=float)
+        patternsB = np.array([pattern[1] for pattern in patterns], dtype=float)
+        activations = PairActivations(batchSize, self.numInputs, self.numHidden)
         for i in range(iterations):
-            for pattern in patterns:
-                self.propagate(pattern[0])
-                self.propagate(pattern[1])
-                self.backpropagate()
+            for start in range(0, len(patterns), batchSize):
+                activations = self.trainBatch(
+                    patternsA[start : start + batchSize],
+                    patternsB[start : start + batchSize],
+                    activations,
+                )
 
     def countMisorderedPairs(self, patterns):
-        # TODO: Let the network classify all pairs of patterns. The highest output determines the winner.
-        # for each pair, do
-        # Propagate A
-        # Propagate B
-        # if A>B: A wins. If B>A: B wins
-        # if rating(winner) > rating(loser): numRight++
-        # else: numMisses++
-        # end of for
-        # TODO: Calculate the ratio of correct answers:
+        # Let the network classify all pairs of patterns. The highest output determines the winner.
+        # A pair is right if A, the higher rated pattern, gets the higher output.
         # errorRate = numMisses/(numRight+numMisses)
-        numRight = 0
-        numMisses = 0
-
-        for pattern in patterns:
-            self.propagate(pattern[0])
-            self.propagate(pattern[1])
-            if self.prevOutputActivation > self.outputActivation:
-                numRight += 1
-            else:
-                numMisses += 1
+        outputA = self.score([pattern[0] for pattern in patterns])
+        outputB = self.score([pattern[1] for pattern in patterns])
+        numRight = int(np.count_nonzero(outputA > outputB))
+        numMisses = len(patterns) - numRight
         errorRate = numMisses / (numRight + numMisses)
         return errorRate
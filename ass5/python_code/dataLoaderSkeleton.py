@@ -1,6 +1,15 @@
 __author__ = "kaiolae"
 __author__ = "kaiolae"
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+
 import Backprop_skeleton as Bp
+import evaluation
+
 
 # Class for holding your data - one object for each line in the examples
 class dataInstance:
@@ -22,95 +31,554 @@ class dataInstance:
 
 # A class that holds all the data in one of our sets (the training set or the testset)
 class dataHolder:
-    def __init__(self, dataset):
-        self.dataset = self.loadData(dataset)
-
-    def loadData(self, file):
-        # Input: A file with the data.
-        # Output: A dict mapping each query ID to the relevant documents, like this: examples[queryID] = [dataInstance1, dataInstance2, ...]
-        data = open(file)
-        dataset = {}
-        for line in data:
-            # Extracting all the useful info from the line of data
-            lineData = line.split()
-            rating = int(lineData[0])
-            qid = int(lineData[1].split(":")[1])
-            features = []
-            for elem in lineData[2:]:
-                if "#docid" in elem:  # We reached a comment. Line done.
-                    break
-                features.append(float(elem.split(":")[1]))
-            # Creating a new data instance, inserting in the dict.
-            di = dataInstance(qid, rating, features)
-            if qid in dataset.keys():
-                dataset[qid].append(di)
-            else:
-                dataset[qid] = [di]
-        return dataset
-
-
-def runRanker(trainingset, testset):
-    # TODO: Insert the code for training and testing your ranker here.
-    # Dataholders for training and testset
-    dhTraining = dataHolder(trainingset)
-    dhTesting = dataHolder(testset)
-
-    # Creating an ANN instance - feel free to experiment with the learning rate (the third parameter).
-    nn = Bp.NN(46, 10, 0.001)
-
-    # TODO: The lists below should hold training patterns in this format: [(data1Features,data2Features), (data1Features,data3Features), ... , (dataNFeatures,dataMFeatures)]
-    # TODO: The training set needs to have pairs ordered so the first item of the pair has a higher rating.
-    trainingPatterns = (
-        []
-    )  # For holding all the training patterns we will feed the network
-    testPatterns = []  # For holding all the test patterns we will feed the network
-    for qid in dhTraining.dataset.keys():
-        # This iterates through every query ID in our training set
-        dataInstance = dhTraining.dataset[
-            qid
-        ]  # All data instances (query, features, rating) for query qid
-        # TODO: Store the training instances into the trainingPatterns array. Remember to store them as pairs, where the first item is rated higher than the second.
-        # TODO: Hint: A good first step to get the pair ordering right, is to sort the instances based on their rating for this query. (sort by x.rating for each x in dataInstance)
-        dataInstance.sort(key=lambda instance: instance.rating)
-        for i in range(len(dataInstance)):
-            for pairing in dataInstance[i:]:
-                if dataInstance[i].rating != pairing.rating:
-                    trainingPatterns.append(
-                        (pairing.features, dataInstance[i].features)
+    def __init__(self, dataset, cache=True, queries=None):
+        # The documents as arrays, stored once: one row per document, grouped
+        # by query. The documents of query number q, with ID qids[q], are the
+        # rows queryOffsets[q] to queryOffsets[q + 1].
+        # The file is only read when the arrays are first used, and with cache
+        # they are memory-mapped rather than parsed after the first time.
+        # With queries, a sequence of query numbers in the file, only those
+        # queries are held, in that order.
+        self.file = dataset
+        self.cache = cache
+        self.queries = queries
+        self.arrays = None
+
+    def load(self):
+        if self.arrays is None:
+            arrays = loadLetor(self.file, self.cache)
+            if self.queries is not None:
+                arrays = selectQueries(*arrays, self.queries)
+            self.arrays = arrays
+        return self.arrays
+
+    @property
+    def features(self):
+        return self.load()[0]
+
+    @property
+    def ratings(self):
+        return self.load()[1]
+
+    @property
+    def qids(self):
+        return self.load()[2]
+
+    @property
+    def queryOffsets(self):
+        return self.load()[3]
+
+    @property
+    def dataset(self):
+        # A dict mapping each query ID to the relevant documents, like this: examples[queryID] = [dataInstance1, dataInstance2, ...]
+        return {
+            int(qid): [
+                dataInstance(int(qid), int(self.ratings[i]), list(self.features[i]))
+                for i in range(self.queryOffsets[q], self.queryOffsets[q + 1])
+            ]
+            for q, qid in enumerate(self.qids)
+        }
+
+
+# Files in the SVMlight/LETOR format: one document per line, as
+# "<rating> qid:<qid> 1:<value> 2:<value> ... #<comment>"
+CACHE_ARRAYS = ("features", "ratings", "qids", "queryOffsets")
+# Changed whenever parseLetor can give other arrays for the same file, so
+# caches written by an older parser are not used
+CACHE_FORMAT = 2
+
+
+def loadLetor(file, cache=True):
+    # Returns a float32 feature matrix, the ratings, the query IDs and the query
+    # offsets, with the documents grouped by query in order of appearance.
+    # With cache, the arrays are saved as .npy files in the directory
+    # <file>.cache and memory-mapped on later loads, as long as the modified
+    # time and size of the file and CACHE_FORMAT are unchanged.
+    cacheDir = file + ".cache"
+    stat = os.stat(file)
+    source = {
+        "format": CACHE_FORMAT,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+    if cache:
+        try:
+            with open(os.path.join(cacheDir, "source.json")) as f:
+                if json.load(f) == source:
+                    return tuple(
+                        np.load(os.path.join(cacheDir, name + ".npy"), mmap_mode="r")
+                        for name in CACHE_ARRAYS
                     )
+        except (OSError, ValueError):
+            pass
+
+    arrays = parseLetor(file)
+    if cache:
+        os.makedirs(cacheDir, exist_ok=True)
+        # Every file is written under a temporary name and then renamed, so
+        # concurrent readers never see a partial file. source.json is written
+        # last, so an interrupted write is never mistaken for a cache.
+        for name, array in zip(CACHE_ARRAYS, arrays):
+            path = os.path.join(cacheDir, name + ".npy")
+            with open(f"{path}.{os.getpid()}", "wb") as f:
+                np.save(f, array)
+            os.replace(f"{path}.{os.getpid()}", path)
+        path = os.path.join(cacheDir, "source.json")
+        with open(f"{path}.{os.getpid()}", "w") as f:
+            json.dump(source, f)
+        os.replace(f"{path}.{os.getpid()}", path)
+    return arrays
+
+
+def parseLetor(file, chunkLines=65536):
+    # Reads the file chunkLines lines at a time, so memory holds one chunk of
+    # text and the float32 blocks parsed so far rather than the whole file as
+    # strings. Every line is placed by its own feature numbers, and features
+    # a line leaves out are 0.
+    blocks = []
+    ratingBlocks = []
+    qidBlocks = []
+    numFeatures = 0
+    with open(file) as data:
+        while True:
+            lines = list(itertools.islice(data, chunkLines))
+            if not lines:
+                break
+            block, ratings, docQids = parseLetorLines(lines)
+            blocks.append(block)
+            ratingBlocks.append(ratings)
+            qidBlocks.append(docQids)
+            numFeatures = max(numFeatures, block.shape[1])
+
+    ratings = np.concatenate(ratingBlocks) if ratingBlocks else np.empty(0, int)
+    docQids = np.concatenate(qidBlocks) if qidBlocks else np.empty(0, int)
+    features = np.zeros((len(ratings), numFeatures), dtype=np.float32)
+    start = 0
+    while blocks:
+        block = blocks.pop(0)
+        features[start : start + len(block), : block.shape[1]] = block
+        start += len(block)
+
+    # Grouping the documents by query, keeping the order queries first appear
+    qids, first, inverse = np.unique(docQids, return_index=True, return_inverse=True)
+    queryOrder = np.argsort(first)
+    rank = np.empty_like(queryOrder)
+    rank[queryOrder] = np.arange(len(queryOrder))
+    rows = np.argsort(rank[inverse], kind="stable")
+    counts = np.bincount(rank[inverse], minlength=len(qids))
+    queryOffsets = np.concatenate(([0], np.cumsum(counts)))
+    if np.any(rows != np.arange(len(rows))):
+        # Files are usually grouped by query already, which needs no copy
+        features, ratings, docQids = features[rows], ratings[rows], docQids[rows]
+    return features, ratings, qids[queryOrder], queryOffsets
+
+
+def parseLetorLines(lines):
+    # Parses lines of "<rating> qid:<qid> <feature>:<value> ... #<comment>"
+    # into a float32 block with one column per feature number up to the
+    # largest in the lines, and the ratings and query IDs
+    rows = [line.split("#", 1)[0].split() for line in lines]
+    rows = [row for row in rows if row]
+    for row in rows:
+        if len(row) < 2 or not row[1].startswith("qid:"):
+            raise ValueError(f"not a LETOR line: {' '.join(row)}")
+    ratings = np.array([row[0] for row in rows], dtype=float).astype(int)
+    docQids = np.array([row[1][4:] for row in rows], dtype=int)
+    counts = np.array([len(row) - 2 for row in rows], dtype=np.intp)
+    pairs = " ".join(" ".join(row[2:]) for row in rows)
+    if pairs.count(":") != counts.sum():
+        raise ValueError("features must be given as <number>:<value>")
+    pairs = np.array(pairs.replace(":", " ").split(), dtype=float).reshape(-1, 2)
+    featureIds = pairs[:, 0].astype(np.intp)
+    if len(featureIds) and featureIds.min() < 1:
+        raise ValueError("feature numbers start at 1")
+    block = np.zeros(
+        (len(rows), featureIds.max() if len(featureIds) else 0), dtype=np.float32
+    )
+    block[np.repeat(np.arange(len(rows)), counts), featureIds - 1] = pairs[:, 1]
+    return block, ratings, docQids
+
+
+def selectQueries(features, ratings, qids, queryOffsets, queries):
+    # The arrays of loadLetor for only the given query numbers, in that order
+    queries = np.asarray(queries, dtype=np.intp)
+    starts = queryOffsets[queries]
+    counts = queryOffsets[queries + 1] - starts
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    rows = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], counts)
+    return features[rows], ratings[rows], qids[queries], offsets
+
+
+def splitQueries(trainingset, validationFraction, rng):
+    # Draws validationFraction of the queries of the training file, at least
+    # one if it is above 0, to hold out for validation. Returns the sorted
+    # query numbers of the training and the validation queries.
+    queries = len(loadLetor(trainingset)[3]) - 1
+    held = int(round(validationFraction * queries))
+    if validationFraction > 0:
+        held = max(held, 1)
+    if held >= queries:
+        raise ValueError("the validation split leaves no training queries")
+    permutation = rng.permutation(queries)
+    return np.sort(permutation[held:]), np.sort(permutation[:held])
+
+
+def rankedPairs(ratings, start, stop, maxPairs=None, rng=None):
+    # Row indices of the pairs of documents in rows start to stop with
+    # different ratings, the higher rated document first: every pair, or with
+    # maxPairs a uniform sample of at most that many distinct pairs.
+    # With the documents sorted by rating, the documents rated lower than the
+    # one at sorted position i are the positions before the first with its
+    # rating. Numbering the pairs (i, j) higher document first, pair number k
+    # is found by a binary search in the running count of pairs, so a sample
+    # is drawn without ever looking at every pair.
+    order = np.argsort(ratings[start:stop], kind="stable")
+    sortedRatings = ratings[start:stop][order]
+    lowerCounts = np.searchsorted(sortedRatings, sortedRatings, side="left")
+    pairEnds = np.cumsum(lowerCounts)
+    numPairs = int(pairEnds[-1]) if len(pairEnds) else 0
+    if maxPairs is None or numPairs <= maxPairs:
+        k = np.arange(numPairs)
+    else:
+        if rng is None:
+            rng = np.random.default_rng()
+        k = rng.choice(numPairs, maxPairs, replace=False)
+    i = np.searchsorted(pairEnds, k, side="right")
+    j = k - (pairEnds[i] - lowerCounts[i])
+    return order[i] + start, order[j] + start
+
+
+def pairBatches(
+    dh, batchSize, maxPairsPerQuery=None, shuffle=True, rng=None, bufferSize=65536
+):
+    # Lazily yields mini-batches of (higher, lower) row indices into dh.features.
+    # Pairs are only generated for one query at a time and shuffled within a
+    # buffer of bufferSize pairs, so memory is bounded by the largest query and
+    # the buffer, not by the total number of pairs. With maxPairsPerQuery, a
+    # random sample of at most that many pairs is drawn from each query, in
+    # time and memory that grow with the sample rather than the query.
+    if rng is None:
+        rng = np.random.default_rng()
+    queries = len(dh.queryOffsets) - 1
+    order = rng.permutation(queries) if shuffle else range(queries)
+
+    pending = []
+    pendingSize = 0
+    for q in order:
+        higher, lower = rankedPairs(
+            dh.ratings,
+            dh.queryOffsets[q],
+            dh.queryOffsets[q + 1],
+            maxPairsPerQuery,
+            rng,
+        )
+        pending.append((higher, lower))
+        pendingSize += len(higher)
+        if pendingSize >= bufferSize:
+            higher, lower = (np.concatenate(a) for a in zip(*pending))
+            if shuffle:
+                permutation = rng.permutation(len(higher))
+                higher, lower = higher[permutation], lower[permutation]
+            full = len(higher) - len(higher) % batchSize
+            for start in range(0, full, batchSize):
+                yield higher[start : start + batchSize], lower[
+                    start : start + batchSize
+                ]
+            pending = [(higher[full:], lower[full:])]
+            pendingSize = len(higher) - full
+
+    if pendingSize:
+        higher, lower = (np.concatenate(a) for a in zip(*pending))
+        if shuffle:
+            permutation = rng.permutation(len(higher))
+            higher, lower = higher[permutation], lower[permutation]
+        for start in range(0, len(higher), batchSize):
+            yield higher[start : start + batchSize], lower[start : start + batchSize]
+
+
+def evaluateRanker(nn, dh, k=10):
+    # Scores every document once, then computes the misordered pair rate,
+    # NDCG@k and MAP query by query
+    return evaluation.evaluateRanking(
+        nn.score(dh.features), dh.ratings, dh.queryOffsets, k
+    )
+
+
+def misorderedPairRate(nn, dh):
+    return evaluateRanker(nn, dh)["errorRate"]
+
+
+# The metrics recorded for every epoch of every restart, for every set
+CURVE_METRICS = ("accuracy", "ndcg", "map")
+
+
+def trainRestart(
+    seed,
+    trainingset,
+    testset,
+    numHidden=10,
+    learningRate=0.0005,
+    epochs=25,
+    batchSize=1,
+    patience=None,
+    maxPairsPerQuery=None,
+    validationFraction=0.2,
+    validationMetric="validationAccuracy",
+    checkpointFile=None,
+    checkpointEvery=1,
+):
+    # One independent training run, seeded so it can run in any process. Returns
+    # the learning curves: each metric of every set before training and after
+    # every epoch, and modelEpoch, the epoch the final weights are from.
+    # With maxPairsPerQuery, every epoch trains on a fresh sample of at most
+    # that many pairs of each query.
+    # validationFraction of the training queries are held out as a validation
+    # set, which is not trained on. With patience, training stops once
+    # validationMetric (a training or validation curve, higher is better) has
+    # not improved for that many epochs, and the weights of its best epoch are
+    # kept. The test set is only evaluated, never used to pick the model.
+    # With checkpointFile, the training state is saved there every
+    # checkpointEvery epochs, and training resumes from the file if it already
+    # exists.
+    if validationMetric.startswith("testing"):
+        raise ValueError("the test set is for reporting, not model selection")
+    resume = checkpointFile is not None and os.path.exists(checkpointFile)
+    if resume:
+        nn, best, state = loadCheckpoint(checkpointFile)
+        rng = np.random.default_rng()
+        rng.bit_generator.state = state["rng"]
+    else:
+        rng = np.random.default_rng(seed)
+        trainingQueries, validationQueries = splitQueries(
+            trainingset, validationFraction, rng
+        )
+        state = {
+            "epoch": 0,
+            "bestEpoch": 0,
+            "stopped": False,
+            "trainingQueries": trainingQueries.tolist(),
+            "validationQueries": validationQueries.tolist(),
+        }
+    sets = {"training": dataHolder(trainingset, queries=state["trainingQueries"])}
+    if state["validationQueries"]:
+        sets["validation"] = dataHolder(trainingset, queries=state["validationQueries"])
+    sets["testing"] = dataHolder(testset)
+    dhTraining = sets["training"]
+    if not resume:
+        nn = Bp.NN(dhTraining.features.shape[1], numHidden, learningRate, rng=rng)
+        best = (nn.weightsInput.copy(), nn.weightsOutput.copy())
+        state["curves"] = {
+            f"{name}{metric.capitalize()}": []
+            for name in sets
+            for metric in CURVE_METRICS
+        }
+        recordEpoch(nn, sets, state["curves"])
+    curves = state["curves"]
+    if validationMetric not in curves:
+        raise ValueError(f"unknown validation metric {validationMetric!r}")
+
+    while state["epoch"] < epochs and not state["stopped"]:
+        # Training, on pairs ordered so the first item has the higher rating
+        for higher, lower in pairBatches(
+            dhTraining, batchSize, maxPairsPerQuery, rng=rng
+        ):
+            nn.trainBatch(dhTraining.features[higher], dhTraining.features[lower])
+        state["epoch"] += 1
+        recordEpoch(nn, sets, curves)
+
+        value = curves[validationMetric][-1]
+        bestValue = curves[validationMetric][state["bestEpoch"]]
+        if value is not None and (bestValue is None or value > bestValue):
+            state["bestEpoch"] = state["epoch"]
+            best = (nn.weightsInput.copy(), nn.weightsOutput.copy())
+        elif patience is not None and state["epoch"] - state["bestEpoch"] >= patience:
+            state["stopped"] = True
+        if checkpointFile is not None and (
+            state["epoch"] % checkpointEvery == 0
+            or state["epoch"] == epochs
+            or state["stopped"]
+        ):
+            state["rng"] = rng.bit_generator.state
+            saveCheckpoint(checkpointFile, nn, best, state)
+
+    modelEpoch = state["epoch"]
+    if patience is not None:
+        nn.weightsInput[:], nn.weightsOutput[:] = best
+        modelEpoch = state["bestEpoch"]
+    return dict(curves, modelEpoch=modelEpoch)
+
+
+def recordEpoch(nn, sets, curves):
+    # Appends the metrics of the network on every set, a dict of dataHolders
+    # by name, to the learning curves
+    for name, dh in sets.items():
+        result = evaluateRanker(nn, dh)
+        curves[f"{name}Accuracy"].append(1 - result["errorRate"])
+        curves[f"{name}Ndcg"].append(result["ndcg"])
+        curves[f"{name}Map"].append(result["map"])
+
+
+# Checkpoints are .npz files holding the current weights, as saved by NN.save,
+# the best weights so far, and the rest of the training state as JSON,
+# including the state of the random generator.
+
+
+def saveCheckpoint(file, nn, best, state):
+    # Written under a temporary name and then renamed, so an interrupted write
+    # never replaces a good checkpoint with a partial one
+    with open(f"{file}.{os.getpid()}", "wb") as f:
+        nn.save(
+            f,
+            bestWeightsInput=best[0],
+            bestWeightsOutput=best[1],
+            state=json.dumps(state),
+        )
+    os.replace(f"{file}.{os.getpid()}", file)
+
+
+def loadCheckpoint(file):
+    # Returns the network, the best weights and the training state
+    nn = Bp.NN.load(file)
+    with np.load(file) as data:
+        best = (data["bestWeightsInput"], data["bestWeightsOutput"])
+        state = json.loads(str(data["state"]))
+    return nn, best, state
+
+
+def runRestarts(
+    trainingset,
+    testset,
+    restarts=10,
+    seed=None,
+    workers=None,
+    checkpointDir=None,
+    **kwargs,
+):
+    # Runs independent restarts of trainRestart in a process pool, or one after
+    # the other in this process with one worker. Every restart gets its own
+    # seed spawned from seed, so the results do not depend on the number of
+    # workers. With checkpointDir, restart i is checkpointed to
+    # restart<i>.npz in that directory, and running again with the same
+    # arguments resumes the restarts from there. Other keyword arguments go to
+    # trainRestart.
+    seeds = np.random.SeedSequence(seed).spawn(restarts)
+    checkpointFiles = [None] * restarts
+    if checkpointDir is not None:
+        os.makedirs(checkpointDir, exist_ok=True)
+        checkpointFiles = [
+            os.path.join(checkpointDir, f"restart{i}.npz") for i in range(restarts)
+        ]
+    if workers == 1:
+        return [
+            trainRestart(
+                s, trainingset, testset, checkpointFile=checkpointFile, **kwargs
+            )
+            for s, checkpointFile in zip(seeds, checkpointFiles)
+        ]
+    # Imported here, as the pool is only needed for training
+    import concurrent.futures
+
+    # Loading the sets once up front leaves a cache for the workers to map
+    loadLetor(trainingset)
+    loadLetor(testset)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                trainRestart,
+                s,
+                trainingset,
+                testset,
+                checkpointFile=checkpointFile,
+                **kwargs,
+            )
+            for s, checkpointFile in zip(seeds, checkpointFiles)
+        ]
+        return [future.result() for future in futures]
+
+
+def meanOfDefined(values):
+    defined = [v for v in values if v is not None]
+    return float(np.mean(defined)) if defined else None
+
+
+def writeLearningCurve(file, runs):
+    # Writes the per-epoch curves of every restart and their mean as JSON. Runs
+    # that stopped early count towards the mean up to the epoch they stopped.
+    mean = {
+        key: [
+            meanOfDefined(values)
+            for values in itertools.zip_longest(*(run[key] for run in runs))
+        ]
+        for key in runs[0]
+        if isinstance(runs[0][key], list)
+    }
+    with open(file, "w") as f:
+        json.dump({"restarts": len(runs), "mean": mean, "runs": runs}, f, indent=1)
+
+
+def runRanker(trainingset, testset, curveFile="learning_curve.json", **kwargs):
+    # Trains and tests the ranker with several restarts, stores the learning
+    # curves in curveFile (see listhandler.py for plotting them) and prints the
+    # mean accuracies of the final models. Keyword arguments go to runRestarts.
+    runs = runRestarts(trainingset, testset, **kwargs)
+    writeLearningCurve(curveFile, runs)
+    print(f"Restarts: {len(runs)}")
+    for name in ("training", "validation", "testing"):
+        if f"{name}Accuracy" not in runs[0]:
+            continue
+        accuracy = np.mean([r[f"{name}Accuracy"][r["modelEpoch"]] for r in runs])
+        print(f"{name.capitalize()} accuracy: {accuracy}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Trains RankNet rankers on LETOR files with several restarts."
+    )
+    parser.add_argument("trainingset", nargs="?", default="train.txt")
+    parser.add_argument("testset", nargs="?", default="test.txt")
+    parser.add_argument("--hidden", type=int, default=10, help="hidden nodes")
+    parser.add_argument("--learning-rate", type=float, default=0.0005)
+    parser.add_argument("--epochs", type=int, default=25)
+    parser.add_argument("--restarts", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1, help="pairs per update")
+    parser.add_argument("--patience", type=int, help="epochs without improvement")
+    parser.add_argument(
+        "--max-pairs-per-query", type=int, help="pairs sampled per query and epoch"
+    )
+    parser.add_argument(
+        "--validation-fraction",
+        type=float,
+        default=0.2,
+        help="share of training queries held out for validation",
+    )
+    parser.add_argument(
+        "--validation-metric",
+        default="validationAccuracy",
+        help="training or validation curve for early stopping",
+    )
+    parser.add_argument("--workers", type=int, help="processes, default one per core")
+    parser.add_argument("--seed", type=int, help="default fresh entropy")
+    parser.add_argument("--checkpoint-dir", help="checkpoint and resume restarts")
+    parser.add_argument("--curve-file", default="learning_curve.json")
+    args = parser.parse_args(argv)
+    runRanker(
+        args.trainingset,
+        args.testset,
+        curveFile=args.curve_file,
+        restarts=args.restarts,
+        seed=args.seed,
+        workers=args.workers,
+        checkpointDir=args.checkpoint_dir,
+        numHidden=args.hidden,
+        learningRate=args.learning_rate,
+        epochs=args.epochs,
+        batchSize=args.batch_size,
+        patience=args.patience,
+        maxPairsPerQuery=args.max_pairs_per_query,
+        validationFraction=args.validation_fraction,
+        validationMetric=args.validation_metric,
+    )
+
 
-    for qid in dhTesting.dataset.keys():
-        # This iterates through every query ID in our test set
-        dataInstance = dhTesting.dataset[qid]
-        # TODO: Store the test instances into the testPatterns array, once again as pairs.
-        # TODO: Hint: The testing will be easier for you if you also now order the pairs - it will make it easy to see if the ANN agrees with your ordering.
-        dataInstance.sort(key=lambda instance: instance.rating)
-        for i in range(len(dataInstance)):
-            for pairing in dataInstance[i:]:
-                if dataInstance[i].rating != pairing.rating:
-                    testPatterns.append((pairing.features, dataInstance[i].features))
-
-    # Check ANN performance before training
-    trainingProg = [0.0] * 26
-    testingProg = [0.0] * 26
-    for i in range(10):
-        nn = Bp.NN(46, 10, 0.0005)
-        trainingProg[0] += (1 - nn.countMisorderedPairs(trainingPatterns)) / 10.0
-        testingProg[0] += (1 - nn.countMisorderedPairs(testPatterns)) / 10.0
-        for j in range(25):
-            # Running 25 iterations, measuring testing performance after each round of training.
-            # Training
-            nn.train(trainingPatterns, iterations=1)
-            # Check ANN performance after training.
-            trainingProg[j + 1] += (
-                1 - nn.countMisorderedPairs(trainingPatterns)
-            ) / 10.0
-            testingProg[j + 1] += (1 - nn.countMisorderedPairs(testPatterns)) / 10.0
-            print("Run: " + str(i))
-            print(trainingProg)
-            print(testingProg)
-
-    # TODO: Store the data returned by countMisorderedPairs and plot it, showing how training and testing errors develop.
-
-
-runRanker("train.txt", "test.txt")
+if __name__ == "__main__":
+    main()
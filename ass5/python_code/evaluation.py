@@ -0,0 +1,81 @@
+import numpy as np
+
+# Ranking metrics for a set of queries. Every document is scored once, and the
+# documents of query number q are the rows queryOffsets[q] to
+# queryOffsets[q + 1] of the scores and ratings.
+
+
+# Counts the pairs of documents with different ratings where the higher rated
+# document does not get the higher score, for one query. The scores are sorted
+# once, and going through the documents from the highest score down, every
+# document counts the lower rated ones seen before it from running counts per
+# rating level, in O(n log n + n L) for L levels rather than looking at every
+# pair. Equal scores are visited lower rated first, so ties count as misses.
+def misorderedPairs(scores, ratings):
+    levels, ranks = np.unique(ratings, return_inverse=True)
+    ranks = ranks.ravel()[np.lexsort((ranks.ravel(), -np.asarray(scores)))]
+    levelCounts = np.zeros((len(ranks), len(levels)), dtype=np.int64)
+    levelCounts[np.arange(len(ranks)), ranks] = 1
+    # seen[j, l]: the documents of level l before document j
+    seen = np.cumsum(levelCounts, axis=0) - levelCounts
+    # seenBelow[j, l]: the documents below level l before document j
+    seenBelow = np.cumsum(seen, axis=1) - seen
+    numMisses = int(seenBelow[np.arange(len(ranks)), ranks].sum())
+    sizes = np.bincount(ranks, minlength=len(levels))
+    numPairs = int((len(ranks) ** 2 - (sizes**2).sum()) // 2)
+    return numMisses, numPairs
+
+
+# Normalized discounted cumulative gain of the k highest scored documents, with
+# gain 2^rating - 1. None if no document has a positive rating.
+def ndcgAtK(scores, ratings, k):
+    discounts = 1.0 / np.log2(np.arange(2, min(k, len(scores)) + 2))
+    ranked = ratings[np.argsort(-scores, kind="stable")][:k]
+    ideal = np.sort(ratings)[::-1][:k]
+    idealGain = ((2.0**ideal - 1) * discounts).sum()
+    if idealGain == 0:
+        return None
+    return ((2.0**ranked - 1) * discounts).sum() / idealGain
+
+
+# Average precision, counting documents with a positive rating as relevant.
+# None if no document is relevant.
+def averagePrecision(scores, ratings):
+    relevant = ratings[np.argsort(-scores, kind="stable")] > 0
+    if not relevant.any():
+        return None
+    hits = np.cumsum(relevant)
+    ranks = np.arange(1, len(relevant) + 1)
+    return (hits[relevant] / ranks[relevant]).mean()
+
+
+# Evaluates a ranking of every query. Returns a dict with the overall rate of
+# misordered pairs, mean NDCG@k and MAP over the queries they are defined for,
+# and the per-query values, with None where a metric is undefined.
+def evaluateRanking(scores, ratings, queryOffsets, k=10):
+    queryMisses = []
+    queryPairs = []
+    queryNdcg = []
+    queryAveragePrecision = []
+    for start, stop in zip(queryOffsets[:-1], queryOffsets[1:]):
+        queryScores = np.asarray(scores[start:stop])
+        queryRatings = np.asarray(ratings[start:stop])
+        numMisses, numPairs = misorderedPairs(queryScores, queryRatings)
+        queryMisses.append(numMisses)
+        queryPairs.append(numPairs)
+        queryNdcg.append(ndcgAtK(queryScores, queryRatings, k))
+        queryAveragePrecision.append(averagePrecision(queryScores, queryRatings))
+
+    definedNdcg = [v for v in queryNdcg if v is not None]
+    definedAveragePrecision = [v for v in queryAveragePrecision if v is not None]
+    return {
+        "errorRate": sum(queryMisses) / max(sum(queryPairs), 1),
+        "ndcg": float(np.mean(definedNdcg)) if definedNdcg else None,
+        "map": (
+            float(np.mean(definedAveragePrecision)) if definedAveragePrecision else None
+        ),
+        "queryMisses": queryMisses,
+        "queryPairs": queryPairs,
+        "queryNdcg": queryNdcg,
+        "queryAveragePrecision": queryAveragePrecision,
+    }
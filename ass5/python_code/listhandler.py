@@ -1,36 +1,21 @@
-listraw = [
-    0.5590627393635541,
-    0.5799805027505048,
-    0.601350880857879,
-    0.6213564515005919,
-    0.6401434440498572,
-    0.6568832254021307,
-    0.6702736578232714,
-    0.6816447322609847,
-    0.6925562286748834,
-    0.701350880857879,
-    0.7091567439593344,
-    0.7161687904742009,
-    0.7221641946939628,
-    0.7269967272474062,
-    0.7307429844718335,
-    0.7345310215166075,
-    0.7370238841306315,
-    0.7378316273240025,
-    0.7389736090801476,
-    0.7397047559362161,
-    0.7402757468142886,
-    0.7405542789499339,
-    0.740505535826196,
-    0.7404985725228049,
-    0.7404846459160225,
-    0.7401295174430751,
-]
-prtstr = ""
-for i in range(len(listraw)):
-    prtstr += "("
-    prtstr += str(i)
-    prtstr += ","
-    prtstr += str(listraw[i])
-    prtstr += ")"
-print(prtstr)
+import json
+import sys
+
+
+# Loads the learning curves written by runRanker in dataLoaderSkeleton.py
+def loadLearningCurve(file):
+    with open(file) as f:
+        return json.load(f)
+
+
+# Formats a curve as pgfplots coordinates: (0,y0)(1,y1)...
+def coordinates(values):
+    return "".join(f"({i},{v})" for i, v in enumerate(values))
+
+
+def main(file="learning_curve.json", key="testingAccuracy"):
+    print(coordinates(loadLearningCurve(file)["mean"][key]))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
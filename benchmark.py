@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# benchmark.py: Throughput, peak memory and scaling of the HMM smoothing,
+# decision tree learning and ranker training code, on synthetic inputs of
+# growing size. Writes the results as JSON.
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Sequence
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+for directory in (
+    "ass2",
+    os.path.join("ass4", "decision"),
+    os.path.join("ass5", "python_code"),
+):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+import Backprop_skeleton  # noqa: E402
+import decision  # noqa: E402
+import hmm  # noqa: E402
+
+
+class Case(NamedTuple):
+    # The size of the input, as named parameters
+    size: Dict[str, int]
+    # The number of items processed, for the throughput
+    items: int
+    # Runs the measured code once. Input generation happens before.
+    run: Callable[[], object]
+
+
+def hmm_forward_backward(length: int) -> Case:
+    rng = np.random.default_rng(length)
+    evidence = rng.integers(0, 2, length).astype(bool)
+    prior = np.array([[0.5], [0.5]])
+    return Case(
+        {"length": length}, length, lambda: hmm.forward_backward(evidence, prior)
+    )
+
+
+def _tree_dataset(rows: int, attributes: int) -> decision.Dataset:
+    # Binary attributes valued 1 and 2 like the assignment data, with labels
+    # from a rule on the first three attributes and 10% noise
+    rng = np.random.default_rng(rows * attributes)
+    features = rng.integers(1, 3, (rows, attributes))
+    labels = ((features[:, 0] == 1) & (features[:, 1] == 2)) | (features[:, 2] == 1)
+    labels ^= rng.random(rows) < 0.1
+    return decision.Dataset(features, labels.astype(int) + 1)
+
+
+def tree_learning(rows: int, attributes: int) -> Case:
+    examples = _tree_dataset(rows, attributes)
+    return Case(
+        {"rows": rows, "attributes": attributes},
+        rows,
+        lambda: decision.decision_tree_learning(
+            examples, list(range(attributes)), None
+        ),
+    )
+
+
+def tree_classify_example(rows: int, attributes: int) -> Case:
+    examples = _tree_dataset(rows, attributes)
+    tree = decision.decision_tree_learning(examples, list(range(attributes)), None)
+    features = examples.features.tolist()
+    return Case(
+        {"rows": rows, "attributes": attributes},
+        rows,
+        lambda: [tree.classify_example(example) for example in features],
+    )
+
+
+def tree_predict(rows: int, attributes: int) -> Case:
+    examples = _tree_dataset(rows, attributes)
+    tree = decision.CompiledTree.from_node(
+        decision.decision_tree_learning(examples, list(range(attributes)), None)
+    )
+    return Case(
+        {"rows": rows, "attributes": attributes},
+        rows,
+        lambda: tree.predict(examples.features),
+    )
+
+
+def _pairs(pairs: int, inputs: int) -> List[tuple]:
+    rng = np.random.default_rng(pairs)
+    higher = rng.normal(0.2, 1, (pairs, inputs))
+    lower = rng.normal(-0.2, 1, (pairs, inputs))
+    return list(zip(higher, lower))
+
+
+def nn_train(pairs: int, batch_size: int, inputs: int = 46, hidden: int = 10) -> Case:
+    patterns = _pairs(pairs, inputs)
+    nn = Backprop_skeleton.NN(inputs, hidden, rng=np.random.default_rng(0))
+    return Case(
+        {"pairs": pairs, "batch_size": batch_size},
+        pairs,
+        lambda: nn.train(patterns, batchSize=batch_size),
+    )
+
+
+def nn_count_misordered_pairs(pairs: int, inputs: int = 46, hidden: int = 10) -> Case:
+    patterns = _pairs(pairs, inputs)
+    nn = Backprop_skeleton.NN(inputs, hidden, rng=np.random.default_rng(0))
+    return Case({"pairs": pairs}, pairs, lambda: nn.countMisorderedPairs(patterns))
+
+
+# Every benchmark, with the sizes of the full and the quick suite. The first
+# size parameter is the one that grows along the scaling curve.
+BENCHMARKS = {
+    "hmm_forward_backward": (
+        hmm_forward_backward,
+        [(n,) for n in (100, 1000, 10000, 100000)],
+        [(n,) for n in (100, 1000)],
+    ),
+    "tree_learning": (
+        tree_learning,
+        [(n, a) for a in (8, 32) for n in (100, 1000, 10000)],
+        [(n, 8) for n in (100, 1000)],
+    ),
+    "tree_classify_example": (
+        tree_classify_example,
+        [(n, 8) for n in (100, 1000, 10000, 100000)],
+        [(n, 8) for n in (100, 1000)],
+    ),
+    "tree_predict": (
+        tree_predict,
+        [(n, 8) for n in (100, 1000, 10000, 100000)],
+        [(n, 8) for n in (100, 1000)],
+    ),
+    "nn_train": (
+        nn_train,
+        [(n, b) for b in (1, 64) for n in (100, 1000, 10000)],
+        [(n, 1) for n in (100, 1000)],
+    ),
+    "nn_count_misordered_pairs": (
+        nn_count_misordered_pairs,
+        [(n,) for n in (100, 1000, 10000, 100000)],
+        [(n,) for n in (100, 1000)],
+    ),
+}
+
+
+def measure(case: Case, repeat: int) -> Dict[str, object]:
+    """The fastest of repeat timed runs, and the peak memory the code allocates
+    in one more run traced by tracemalloc, which would slow the timed ones"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case.run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        case.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds = min(times)
+    return {
+        "size": case.size,
+        "items": case.items,
+        "seconds": seconds,
+        "items_per_second": case.items / seconds if seconds > 0 else None,
+        "peak_bytes": peak,
+    }
+
+
+def scaling(results: Sequence[Dict[str, object]]) -> List[Dict[str, object]]:
+    """Slope of log(seconds) over log(items) for each series of results that
+    only differ in the first size parameter: 1 is linear scaling"""
+    series: Dict[tuple, list] = {}
+    for result in results:
+        fixed = tuple(list(result["size"].items())[1:])
+        series.setdefault(fixed, []).append(result)
+    curves = []
+    for fixed, points in series.items():
+        if len(points) < 2:
+            continue
+        items = np.log([p["items"] for p in points])
+        seconds = np.log([max(p["seconds"], 1e-9) for p in points])
+        curves.append(
+            {
+                "fixed": dict(fixed),
+                "items": [p["items"] for p in points],
+                "seconds": [p["seconds"] for p in points],
+                "exponent": float(np.polyfit(items, seconds, 1)[0]),
+            }
+        )
+    return curves
+
+
+def run(names: Sequence[str], quick: bool, repeat: int) -> Dict[str, object]:
+    report: Dict[str, object] = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "quick": quick,
+        "benchmarks": {},
+    }
+    for name in names:
+        make_case, sizes, quick_sizes = BENCHMARKS[name]
+        results = []
+        for size in quick_sizes if quick else sizes:
+            result = measure(make_case(*size), repeat)
+            print(
+                f"{name} {result['size']}: {result['seconds']:.4f} s,"
+                f" {result['peak_bytes'] / 2**20:.1f} MiB",
+                file=sys.stderr,
+            )
+            results.append(result)
+        report["benchmarks"][name] = {"results": results, "scaling": scaling(results)}
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks on synthetic inputs, reported as JSON."
+    )
+    parser.add_argument(
+        "benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)}, default all"
+    )
+    parser.add_argument("--quick", action="store_true", help="small sizes only")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size")
+    parser.add_argument("--output", help="JSON file, default standard output")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = run(args.benchmarks or list(BENCHMARKS), args.quick, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == "__main__":
+    main()
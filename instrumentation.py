@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# instrumentation.py: Opt-in call counters and timers for the phases of the
+# learners, and wrappers for cProfile and tracemalloc runs.
+#
+# Nothing is instrumented until enable() is called: it replaces the functions
+# of the chosen phases with timing wrappers, and disable() puts the originals
+# back, so the code runs unchanged and at full speed when it is off. Only the
+# calling process is instrumented, not the workers of a process pool, so run
+# pools with one worker, which the ranker restarts and the random forest then
+# run in this process. Threads of the process are counted, each timed from
+# its own outermost call.
+#
+# From the command line, the main function of a module runs with every phase
+# instrumented, without editing it, and the report is printed as JSON when it
+# ends. Run it from the directory of the data files, for example:
+#
+#   python ../../instrumentation.py [--profile FILE] [--memory] decision
+#   python ../../instrumentation.py dataLoaderSkeleton --restarts 1 --workers 1
+import argparse
+import contextlib
+import cProfile
+import functools
+import importlib
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRECTORIES = [
+    os.path.join(ROOT, "ass2"),
+    os.path.join(ROOT, "ass4", "decision"),
+    os.path.join(ROOT, "ass5", "python_code"),
+]
+
+# Every phase, with the functions it times as (module, attribute path)
+PHASES: Dict[str, List[Tuple[str, str]]] = {
+    "hmm.forward": [("hmm", "HMM.forward"), ("hmm", "HMM._forward_sweep")],
+    "hmm.backward": [("hmm", "HMM.backward"), ("hmm", "HMM._backward_sweep")],
+    "hmm.forward_backward": [
+        ("hmm", "HMM.forward_backward"),
+        ("hmm", "HMM.forward_backward_checkpointed"),
+        ("hmm", "HMM.forward_backward_batch"),
+    ],
+    "hmm.baum_welch": [("hmm", "HMM.baum_welch")],
+    "tree.learning": [("decision", "decision_tree_learning")],
+    "tree.split_scoring": [
+        ("decision", "importance_entropy"),
+        ("decision", "importance_gini"),
+        ("decision", "importance_random"),
+    ],
+    "tree.partition": [("decision", "Dataset.partition")],
+    "tree.classify": [
+        ("decision", "Node.classify_example"),
+        ("decision", "CompiledTree.predict"),
+    ],
+    "nn.forward": [("Backprop_skeleton", "NN.forwardInto")],
+    "nn.delta": [
+        ("Backprop_skeleton", "NN.outputDeltas"),
+        ("Backprop_skeleton", "NN.hiddenDeltas"),
+    ],
+    "nn.weight_update": [("Backprop_skeleton", "NN.weightUpdates")],
+    "nn.train_batch": [("Backprop_skeleton", "NN.trainBatch")],
+    "ranker.load": [("dataLoaderSkeleton", "loadLetor")],
+    "ranker.evaluate": [("dataLoaderSkeleton", "evaluateRanker")],
+}
+
+
+class PhaseStats:
+    def __init__(self) -> None:
+        self.calls: int = 0
+        self.seconds: float = 0.0
+        # Guards calls and seconds, which threads running the phase at the
+        # same time all add to. Their times add up, like in cProfile.
+        self.lock: threading.Lock = threading.Lock()
+        # Holds running for each thread: set while a call of the phase runs
+        # in that thread, so calls nested in it, like the recursion of
+        # decision_tree_learning, are not timed twice
+        self.local: threading.local = threading.local()
+
+    @property
+    def running(self) -> bool:
+        return getattr(self.local, "running", False)
+
+    @running.setter
+    def running(self, value: bool) -> None:
+        self.local.running = value
+
+
+_stats: Dict[str, PhaseStats] = {}
+# The phases currently instrumented
+_enabled: Set[str] = set()
+# The replaced attributes and table entries, as (owner, name, original)
+_patched: List[Tuple[object, str, object]] = []
+
+
+def _timed(function: Callable, stats: PhaseStats) -> Callable:
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stats.lock:
+            stats.calls += 1
+        if stats.running:
+            return function(*args, **kwargs)
+        stats.running = True
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with stats.lock:
+                stats.seconds += elapsed
+            stats.running = False
+
+    return wrapper
+
+
+def enable(phases: Optional[Iterable[str]] = None) -> None:
+    """Instruments the given phases, all of them if None. Their modules are
+    imported if they are not already, and phases whose module can not be
+    imported are skipped. Calling it again instruments more phases.
+    """
+    for directory in SOURCE_DIRECTORIES:
+        if directory not in sys.path:
+            sys.path.append(directory)
+    for phase in PHASES if phases is None else phases:
+        if phase in _enabled:
+            continue
+        stats = _stats.setdefault(phase, PhaseStats())
+        for module_name, path in PHASES[phase]:
+            try:
+                module = importlib.import_module(module_name)
+            except ImportError:
+                continue
+            *owners, name = path.split(".")
+            owner = module
+            for attribute in owners:
+                owner = getattr(owner, attribute)
+            original = vars(owner)[name]
+            wrapper = _timed(original, stats)
+            _patched.append((owner, name, original))
+            setattr(owner, name, wrapper)
+            # Tables of functions, like decision.IMPORTANCE_FUNCTIONS, hold
+            # their own references
+            for table in list(vars(module).values()):
+                if isinstance(table, dict):
+                    for key, value in list(table.items()):
+                        if value is original:
+                            _patched.append((table, key, original))
+                            table[key] = wrapper
+        _enabled.add(phase)
+
+
+def disable() -> None:
+    """Restores every instrumented function. The statistics are kept until
+    reset, so they can be reported afterwards."""
+    while _patched:
+        owner, name, original = _patched.pop()
+        if isinstance(owner, dict):
+            owner[name] = original
+        else:
+            setattr(owner, name, original)
+    for stats in _stats.values():
+        # A fresh one clears the flag of every thread
+        stats.local = threading.local()
+    _enabled.clear()
+
+
+def reset() -> None:
+    """Zeroes the statistics of the instrumented phases and forgets the rest"""
+    for phase in list(_stats):
+        if phase in _enabled:
+            with _stats[phase].lock:
+                _stats[phase].calls = 0
+                _stats[phase].seconds = 0.0
+        else:
+            del _stats[phase]
+
+
+def report() -> Dict[str, Dict[str, float]]:
+    """Calls, total seconds and mean microseconds per call of every phase
+    instrumented since the last reset, slowest first. Time spent in a phase
+    nested in another also counts towards the outer one."""
+    entries = {
+        phase: {
+            "calls": stats.calls,
+            "seconds": stats.seconds,
+            "mean_us": stats.seconds / stats.calls * 1e6 if stats.calls else 0.0,
+        }
+        for phase, stats in _stats.items()
+    }
+    return dict(sorted(entries.items(), key=lambda e: -e[1]["seconds"]))
+
+
+@contextlib.contextmanager
+def instrumented(phases: Optional[Iterable[str]] = None) -> Iterator[None]:
+    """Instruments the phases for the duration of a with block"""
+    enable(phases)
+    try:
+        yield
+    finally:
+        disable()
+
+
+@contextlib.contextmanager
+def profiled(
+    file: Optional[str] = None, sort: str = "cumulative", limit: int = 25
+) -> Iterator[cProfile.Profile]:
+    """Runs a with block under cProfile. The statistics are written to file
+    for pstats or snakeviz if given, and printed to stderr otherwise."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if file is not None:
+            profile.dump_stats(file)
+        else:
+            pstats.Stats(profile, stream=sys.stderr).sort_stats(sort).print_stats(limit)
+
+
+@contextlib.contextmanager
+def traced_memory(limit: int = 10) -> Iterator[Dict[str, object]]:
+    """Traces the allocations of a with block. The yielded dict gets the peak
+    traced bytes and the source lines holding the most memory at the end.
+    If tracing is already on, the peak is that of the block from Python 3.9,
+    and before that the peak since tracing started, as reset_peak is new."""
+    result: Dict[str, object] = {}
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    try:
+        yield result
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        result["top_lines"] = [
+            {"line": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
+        if started:
+            tracemalloc.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Runs the main function of a module with the learners "
+        "instrumented, and prints the phase report as JSON to stderr."
+    )
+    parser.add_argument("--phases", help="comma-separated phases, default all")
+    parser.add_argument("--profile", metavar="FILE", help="also run cProfile")
+    parser.add_argument("--memory", action="store_true", help="trace allocations")
+    parser.add_argument("target", help="module[:function], function main if left out")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    module_name, _, function_name = args.target.partition(":")
+    sys.argv = [module_name] + args.arguments
+    sys.path.insert(0, os.getcwd())
+    result: Dict[str, object] = {}
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            instrumented(None if args.phases is None else args.phases.split(","))
+        )
+        # Imported after enable, so it is the instrumented module that runs
+        function = getattr(
+            importlib.import_module(module_name), function_name or "main"
+        )
+        if args.profile:
+            stack.enter_context(profiled(args.profile))
+        if args.memory:
+            result["memory"] = stack.enter_context(traced_memory())
+        try:
+            function()
+        finally:
+            result["phases"] = report()
+    json.dump(result, sys.stderr, indent=1)
+    print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()